@@ -0,0 +1,146 @@
+import asyncio
+import os
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+from common import tracing
+
+# WebSocket connections accepted at once; extra connections are closed with code 1013 (try again later)
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "256"))
+# Requests processed at once across all clients, and how many more may wait for a slot
+MAX_GLOBAL_IN_FLIGHT = int(os.getenv("MAX_GLOBAL_IN_FLIGHT", "32"))
+MAX_GLOBAL_QUEUE = int(os.getenv("MAX_GLOBAL_QUEUE", "128"))
+# The same limits for each connection
+MAX_IN_FLIGHT_PER_CONNECTION = int(os.getenv("MAX_IN_FLIGHT_PER_CONNECTION", "8"))
+MAX_QUEUED_PER_CONNECTION = int(os.getenv("MAX_QUEUED_PER_CONNECTION", "16"))
+# A request that waits longer than this for a slot is rejected instead of running late;
+# it should stay well below the downstream request timeout
+ADMISSION_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_TIMEOUT_SECONDS", "10"))
+# Suggested client back-off sent with every rejection
+RETRY_AFTER_SECONDS = float(os.getenv("RETRY_AFTER_SECONDS", "2"))
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot get a processing slot in time."""
+    def __init__(self, reason: str, retry_after: float = RETRY_AFTER_SECONDS):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+class AdmissionStats:
+    """Counters shared by one or more limiters (e.g. all per-connection limiters)."""
+    def __init__(self):
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
+
+class Limiter:
+    """
+    A concurrency limit with a bounded wait queue. A request that finds the
+    queue full is rejected at once; a queued request is rejected when its
+    deadline passes before a slot frees up.
+    """
+    def __init__(self, max_in_flight: int, max_queue: int, stats: AdmissionStats):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.stats = stats
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._waiting = 0
+
+    @asynccontextmanager
+    async def slot(self, deadline: float) -> AsyncIterator[None]:
+        """Holds one slot for the duration of the block; deadline is an event-loop time."""
+        if not self._slots.locked():
+            # A free slot is taken at once, even when the deadline has already passed
+            await self._slots.acquire()
+        else:
+            await self._wait_for_slot(deadline)
+
+        self.stats.admitted += 1
+        self.stats.in_flight += 1
+        try:
+            yield
+        finally:
+            self.stats.in_flight -= 1
+            self._slots.release()
+
+    async def _wait_for_slot(self, deadline: float):
+        if self._waiting >= self.max_queue:
+            self.stats.rejected_queue_full += 1
+            raise AdmissionRejected("queue full")
+
+        self._waiting += 1
+        self.stats.waiting += 1
+        self.stats.max_waiting = max(self.stats.max_waiting, self.stats.waiting)
+        acquire = asyncio.ensure_future(self._slots.acquire())
+        try:
+            timeout = max(0.0, deadline - asyncio.get_running_loop().time())
+            done, _ = await asyncio.wait((acquire,), timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(acquire)
+            raise
+        finally:
+            self._waiting -= 1
+            self.stats.waiting -= 1
+        if not done:
+            self._abandon(acquire)
+            self.stats.rejected_timeout += 1
+            raise AdmissionRejected("timed out waiting for a slot")
+
+    def _abandon(self, acquire: "asyncio.Future"):
+        # The acquire may have taken the slot in the same loop iteration as the timeout or
+        # cancellation (asyncio.wait_for can lose it that way); such a slot is given back
+        acquire.cancel()
+        acquire.add_done_callback(self._release_if_acquired)
+
+    def _release_if_acquired(self, acquire: "asyncio.Future"):
+        if not acquire.cancelled() and acquire.exception() is None:
+            self._slots.release()
+
+global_stats = AdmissionStats()
+client_stats = AdmissionStats()
+global_limiter = Limiter(MAX_GLOBAL_IN_FLIGHT, MAX_GLOBAL_QUEUE, global_stats)
+
+def client_limiter() -> Limiter:
+    """Creates the limiter for a new connection; all connections share one set of counters."""
+    return Limiter(MAX_IN_FLIGHT_PER_CONNECTION, MAX_QUEUED_PER_CONNECTION, client_stats)
+
+@asynccontextmanager
+async def admit(client: Limiter) -> AsyncIterator[None]:
+    """
+    Admits one request: a slot from the client's limiter, then a global slot,
+    both within ADMISSION_TIMEOUT_SECONDS of arrival.
+
+    Raises:
+        AdmissionRejected: If either queue is full or the deadline passes.
+    """
+    deadline = asyncio.get_running_loop().time() + ADMISSION_TIMEOUT_SECONDS
+    async with AsyncExitStack() as slots:
+        # The span covers only the wait for slots, not the request itself
+        with tracing.span("admission"):
+            await slots.enter_async_context(client.slot(deadline))
+            await slots.enter_async_context(global_limiter.slot(deadline))
+        yield
+
+def stats() -> Dict[str, Any]:
+    """Returns limits, queue depths and rejection counts."""
+    return {
+        "timeout_seconds": ADMISSION_TIMEOUT_SECONDS,
+        "global": {"max_in_flight": MAX_GLOBAL_IN_FLIGHT, "max_queue": MAX_GLOBAL_QUEUE, **global_stats.to_dict()},
+        "per_connection": {
+            "max_in_flight": MAX_IN_FLIGHT_PER_CONNECTION,
+            "max_queue": MAX_QUEUED_PER_CONNECTION,
+            **client_stats.to_dict(),
+        },
+    }
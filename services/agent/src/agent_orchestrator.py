@@ -1,6 +1,36 @@
-import json
-from typing import Dict, Any
-from . import tool_registry
+import asyncio
+import time
+import uuid
+from contextlib import aclosing, nullcontext, suppress
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional, Set, Union
+from common import log, metrics, tracing
+from . import admission, protocol, result_cache, tool_registry
+
+# Callback used to push intermediate messages to the client while a request is still running
+SendCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+# Callback that ties a background task to the client's connection, so it is cancelled on disconnect
+BackgroundCallback = Callable[[asyncio.Task], None]
+
+# Actions the orchestrator routes; anything else is labelled 'unknown' in metrics
+ACTIONS = (
+    "register_dataset",
+    "get_initial_visualizations",
+    "stream_initial_visualizations",
+    "generate_chart",
+    "train_model",
+    "get_dataset_summary",
+    "submit_training_job",
+    "get_training_job",
+    "cancel_training_job",
+)
+
+ACTION_SECONDS = metrics.histogram(
+    "canvaslytics_agent_action_duration_seconds",
+    "Time from receiving a WebSocket message to its final response, by action and outcome, including admission wait.",
+    ("action", "status"),
+)
+
+logger = log.get_logger("agent.orchestrator")
 
 class AgentOrchestrator:
     """
@@ -8,19 +38,75 @@ class AgentOrchestrator:
     In a real system, this would involve complex reasoning, likely using an LLM.
     This is a simplified rule-based example for demonstration.
     """
-    
-    async def process_user_request(self, message: str) -> Dict[str, Any]:
+    def __init__(self):
+        # Background tasks relaying training job progress to callers without a connection to tie them to
+        self._job_relays: Set[asyncio.Task] = set()
+
+    async def process_user_request(
+        self,
+        message: Union[str, bytes],
+        send: Optional[SendCallback] = None,
+        admit: Optional[Callable[[], AsyncContextManager]] = None,
+        background: Optional[BackgroundCallback] = None,
+        is_open: Optional[Callable[[], bool]] = None,
+    ) -> Dict[str, Any]:
         """
-        Processes a raw JSON string message from the client.
+        Processes a raw message from the client.
 
         Args:
-            message (str): A JSON string from the websocket client.
-        
+            message (str | bytes): A JSON text frame, or a MessagePack binary frame
+                from a client using the binary protocol.
+            send (Callable, optional): Pushes intermediate messages to the client;
+                required by streaming actions.
+            admit (Callable, optional): Returns the admission-control context the
+                request runs in; it may reject the request as busy.
+            background (Callable, optional): Registers tasks that outlive the request
+                (e.g. training job relays) with the connection, which cancels them on disconnect.
+            is_open (Callable, optional): Tells whether the client is still connected.
+
         Returns:
             A dictionary with the result of the tool call or an error message.
         """
         try:
-            request_data = json.loads(message)
+            with tracing.span("decode"):
+                request_data = protocol.decode_request(message)
+        except ValueError as e:
+            return self._create_error_response(str(e))
+        if not isinstance(request_data, dict):
+            return self._create_error_response("Message must be an object.")
+
+        # Echo the client's request_id so it can match responses to out-of-order requests
+        request_id = request_data.get("request_id")
+        # Log records and downstream calls made for this message carry its id
+        log.request_id_var.set(str(request_id) if request_id is not None else uuid.uuid4().hex[:16])
+        action = request_data.get("action")
+        message_span = tracing.current()
+        if message_span is not None:
+            message_span.set(action=action if action in ACTIONS else "unknown", request_id=log.request_id_var.get())
+        started_at = time.perf_counter()
+        try:
+            async with admit() if admit is not None else nullcontext():
+                result = await self._route(request_data, request_id, send, background, is_open)
+            status = result.get("status", "error")
+        except admission.AdmissionRejected as e:
+            result = self._create_error_response(f"Agent is busy ({e.reason}); retry later.", 503)
+            result["retry_after"] = e.retry_after
+            status = "busy"
+        ACTION_SECONDS.labels(action if action in ACTIONS else "unknown", status).observe(time.perf_counter() - started_at)
+        if request_id is not None:
+            result = {**result, "request_id": request_id}
+        return result
+
+    async def _route(
+        self,
+        request_data: Dict[str, Any],
+        request_id: Optional[str],
+        send: Optional[SendCallback],
+        background: Optional[BackgroundCallback] = None,
+        is_open: Optional[Callable[[], bool]] = None,
+    ) -> Dict[str, Any]:
+        """Dispatches one parsed request to its tool."""
+        try:
             action = request_data.get("action")
             payload = request_data.get("payload", {})
 
@@ -28,28 +114,167 @@ class AgentOrchestrator:
                 return self._create_error_response("No 'action' specified in the request.")
 
             # Simple rule-based routing
-            if action == "get_initial_visualizations":
-                return await tool_registry.call_eda_service("/initial-visualizations", payload)
+            if action == "register_dataset":
+                return await tool_registry.register_dataset(payload)
+            elif action == "get_initial_visualizations":
+                return await self._call_eda_cached(action, "/initial-visualizations", payload)
+            elif action == "stream_initial_visualizations":
+                return await self._stream_initial_visualizations(payload, request_id or uuid.uuid4().hex, send)
             elif action == "generate_chart":
-                return await tool_registry.call_eda_service("/generate-chart", payload)
+                return await self._call_eda_cached(action, "/generate-chart", payload)
             elif action == "train_model":
                 return await tool_registry.call_ml_service("/train", payload)
             elif action == "get_dataset_summary":
-                return await tool_registry.call_eda_service("/summarize", payload)
+                return await self._call_eda_cached(action, "/summarize", payload)
+            elif action == "submit_training_job":
+                return await self._submit_training_job(payload, request_id or uuid.uuid4().hex, send, background, is_open)
+            elif action == "get_training_job":
+                return await self._get_training_job(self._job_id(payload))
+            elif action == "cancel_training_job":
+                result = await tool_registry.cancel_training_job(self._job_id(payload))
+                return {**result, "action": action}
             else:
                 return self._create_error_response(f"Unknown action: {action}")
 
-        except json.JSONDecodeError:
-            return self._create_error_response("Invalid JSON message received.")
         except tool_registry.ToolError as e:
             return self._create_error_response(f"Tool execution failed: {e.message}", e.status_code)
         except Exception as e:
             return self._create_error_response(f"An unexpected error occurred: {str(e)}")
 
+    async def _call_eda_cached(self, action: str, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Calls an EDA endpoint through the result cache. EDA results depend only on
+        the dataset and the parameters, so repeat requests are served from the cache.
+        """
+        with tracing.span("cache.lookup") as span:
+            if "data" in payload:
+                # Hashing inline records is proportional to the dataset; keep it off the event loop
+                key = await asyncio.to_thread(result_cache.cache_key, action, payload)
+            else:
+                key = result_cache.cache_key(action, payload)
+            cached = await result_cache.cache.get(key)
+            span.set(hit=cached is not None)
+        if cached is not None:
+            return cached
+        # The cache key identifies endpoint and payload, so it doubles as the single-flight fingerprint
+        result = await tool_registry.call_eda_service(endpoint, payload, fingerprint=key)
+        if result.get("status") == "success":
+            await result_cache.cache.put(key, result)
+        return result
+
+    async def _stream_initial_visualizations(
+        self, payload: Dict[str, Any], request_id: str, send: Optional[SendCallback]
+    ) -> Dict[str, Any]:
+        """
+        Relays the EDA service's chart stream to the client: a 'started' message listing
+        the charts, then one 'partial' message per chart as soon as it is rendered, all
+        tagged with request_id. The returned dictionary is the final 'success' message.
+        """
+        if send is None:
+            return self._create_error_response("Streaming actions require a live connection.")
+
+        action = "stream_initial_visualizations"
+        events = tool_registry.stream_eda_service("/initial-visualizations/stream", payload)
+        async with aclosing(events):
+            async for event in events:
+                status = event.get("status")
+                if status == "complete":
+                    return {
+                        "status": "success",
+                        "action": action,
+                        "request_id": request_id,
+                        "chart_count": event.get("chart_count"),
+                    }
+                if status == "error":
+                    raise tool_registry.ToolError(f"EDA service failed while streaming: {event.get('detail')}")
+                await send({**event, "action": action, "request_id": request_id})
+        raise tool_registry.ToolError("EDA service closed the stream before it completed.")
+
+    @staticmethod
+    def _job_id(payload: Dict[str, Any]) -> str:
+        job_id = payload.get("job_id")
+        if not isinstance(job_id, str) or not job_id:
+            raise tool_registry.ToolError("Payload must contain a 'job_id'.", 400)
+        return job_id
+
+    async def _submit_training_job(
+        self,
+        payload: Dict[str, Any],
+        request_id: str,
+        send: Optional[SendCallback],
+        background: Optional[BackgroundCallback] = None,
+        is_open: Optional[Callable[[], bool]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Queues a training job and returns at once with its id. While the client
+        stays connected, 'job_update' messages tagged with request_id follow as
+        the job progresses; the last one carries the final state and, on
+        success, the result. The relay does not hold an admission slot, and is
+        cancelled with the connection when one is given via `background`.
+        """
+        result = await tool_registry.submit_training_job(payload)
+        job = result["job"]
+        if send is not None:
+            relay = asyncio.create_task(self._relay_training_job(job["job_id"], request_id, send, is_open))
+            if background is not None:
+                background(relay)
+            else:
+                self._job_relays.add(relay)
+                relay.add_done_callback(self._job_relays.discard)
+        return {"status": "success", "action": "submit_training_job", "job": job}
+
+    async def _relay_training_job(
+        self, job_id: str, request_id: str, send: SendCallback, is_open: Optional[Callable[[], bool]] = None
+    ):
+        """Pushes a job's progress events to the client until the job finishes or the client goes away."""
+        def client_gone() -> bool:
+            return is_open is not None and not is_open()
+
+        with tracing.span("training_job.relay", new_trace=True, job_id=job_id):
+            try:
+                events = tool_registry.stream_training_job(job_id)
+                async with aclosing(events):
+                    async for event in events:
+                        # Heartbeats arrive even while the job is quiet, so a departed client is noticed
+                        # within one heartbeat and the upstream stream is closed
+                        if client_gone():
+                            logger.info("Training job relay ended", extra={"job_id": job_id, "reason": "client disconnected"})
+                            return
+                        if event.get("event") in ("heartbeat", "queued"):
+                            continue
+                        message = {
+                            "status": "job_update",
+                            "action": "submit_training_job",
+                            "request_id": request_id,
+                            "job": event,
+                        }
+                        if event.get("state") == "succeeded":
+                            message["result"] = (await tool_registry.get_training_job_result(job_id))["result"]
+                            # The result (a serialized model) may have taken a while to fetch
+                            if client_gone():
+                                return
+                        await send(message)
+            except tool_registry.ToolError as e:
+                logger.warning("Training job relay stopped", extra={"job_id": job_id, "error": e.message})
+                error = self._create_error_response(f"Lost track of training job: {e.message}", e.status_code)
+                with suppress(Exception):
+                    await send({**error, "action": "submit_training_job", "request_id": request_id, "job_id": job_id})
+            except Exception as e:
+                # Typically the client disconnected; the job itself keeps running
+                logger.info("Training job relay ended", extra={"job_id": job_id, "reason": f"{type(e).__name__}: {e}"})
+
+    async def _get_training_job(self, job_id: str) -> Dict[str, Any]:
+        """Returns a job's state, with its result once it has succeeded."""
+        result = await tool_registry.get_training_job(job_id)
+        response = {"status": "success", "action": "get_training_job", "job": result["job"]}
+        if result["job"]["state"] == "succeeded":
+            response["result"] = (await tool_registry.get_training_job_result(job_id))["result"]
+        return response
+
     def _create_error_response(self, message: str, status_code: int = 400) -> Dict[str, Any]:
         """Creates a standardized error response dictionary."""
         return {
             "status": "error",
             "statusCode": status_code,
             "message": message
-        }
\ No newline at end of file
+        }
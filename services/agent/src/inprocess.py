@@ -0,0 +1,111 @@
+"""
+Monolith mode (TOOL_DISPATCH=inprocess): the agent calls the pandas-eda and
+sklearn-lab route handlers directly instead of over HTTP.
+
+The services are imported from the same image (/app/pandas-eda, /app/sklearn-lab)
+and share this process's dataset store and worker pools. Payloads are handed over
+by reference: inline records are not serialized, and a registered dataset is
+stored once and read by both services as the same DataFrame. Only the envelope
+fields are validated, as the services do for HTTP bodies.
+"""
+import asyncio
+import importlib
+import orjson
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from common import datasets, executor, fast_json, tracing
+
+# Short service name -> module holding the service's FastAPI app and its IN_PROCESS_* tables
+SERVICE_MODULES = {"eda": "pandas-eda.main", "ml": "sklearn-lab.main"}
+
+class InProcessError(Exception):
+    """A service handler rejected a call; carries the status and body it would have answered over HTTP."""
+    def __init__(self, status_code: int, body: str):
+        self.status_code = status_code
+        self.body = body
+        super().__init__(body)
+
+_modules: Dict[str, Any] = {}
+_warm_up: Optional["asyncio.Task"] = None
+
+def _module(service: str):
+    module = _modules.get(service)
+    if module is None:
+        # Both services share this process's dataset store; it spills under the agent's name, not theirs
+        datasets.use_spill_dir("agent")
+        module = _modules[service] = importlib.import_module(SERVICE_MODULES[service])
+        # Importing a service names the process after it; spans recorded here still belong to the agent
+        tracing.set_service("agent")
+    return module
+
+def _lookup(service: str, table: str, route: str) -> Tuple[Any, Callable]:
+    try:
+        return getattr(_module(service), table)[route]
+    except KeyError:
+        raise InProcessError(404, orjson.dumps({"detail": "Not Found"}).decode())
+
+def _error(e: Exception) -> InProcessError:
+    if isinstance(e, HTTPException):
+        return InProcessError(e.status_code, orjson.dumps({"detail": e.detail}).decode())
+    return InProcessError(422, fast_json.dumps({"detail": e.errors()}).decode())
+
+def _arguments(model: Any, payload: Optional[Dict[str, Any]]) -> tuple:
+    # Routes without a body model take only their path parameters
+    return () if model is None else (fast_json.validate_envelope(payload, model),)
+
+async def call(
+    service: str, route: str, payload: Optional[Dict[str, Any]] = None, path_params: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """
+    Runs a service route (e.g. '/jobs/{job_id}') in this process and returns its
+    result as the HTTP response would have decoded.
+
+    Raises:
+        InProcessError: If the handler rejects the request.
+    """
+    model, handler = _lookup(service, "IN_PROCESS_ROUTES", route)
+    try:
+        result = await handler(*_arguments(model, payload), **(path_params or {}))
+    except (HTTPException, RequestValidationError) as e:
+        raise _error(e)
+    # Results are small (summaries, images, metrics) next to the dataset; normalize numpy values.
+    # EDA results are taken as the MessagePack response would decode, keeping chart images as raw bytes
+    if service == "eda":
+        return fast_json.to_msgpackable(result)
+    return fast_json.to_jsonable(result)
+
+async def stream(
+    service: str, route: str, payload: Optional[Dict[str, Any]] = None, path_params: Optional[Dict[str, str]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Runs a streaming service route in this process and yields its events."""
+    model, handler = _lookup(service, "IN_PROCESS_STREAMS", route)
+    try:
+        events = await handler(*_arguments(model, payload), **(path_params or {}))
+    except (HTTPException, RequestValidationError) as e:
+        raise _error(e)
+    try:
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
+
+async def start():
+    """Imports the services and warms up the shared render/training workers in the background."""
+    global _warm_up
+    for service in SERVICE_MODULES:
+        _module(service)
+    tools = importlib.import_module("pandas-eda.tools")
+    _warm_up = asyncio.create_task(executor.warm_up_processes(tools.warm_up))
+
+def stop():
+    """Stops the warm-up, running training jobs and the worker pools. Called at app shutdown."""
+    if _warm_up is not None:
+        _warm_up.cancel()
+    if "ml" in _modules:
+        _modules["ml"].jobs.manager.shutdown()
+    executor.shutdown()
+
+def stats() -> Dict[str, Any]:
+    """Dataset store and worker pool metrics of the in-process services."""
+    return {"datasets": datasets.store.stats(), "executor": executor.stats()}
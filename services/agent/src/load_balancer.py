@@ -0,0 +1,191 @@
+import httpx
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+# Consecutive failures (connection errors, 502/503/504) that open a replica's circuit
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+# How long an open circuit rejects traffic before one trial request is let through
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+# Successful latencies kept per endpoint for the p95 estimate, and how many are needed before using it
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "200"))
+LATENCY_MIN_SAMPLES = int(os.getenv("LATENCY_MIN_SAMPLES", "20"))
+
+class NoHealthyReplicaError(Exception):
+    """Raised when every replica of a service has an open circuit."""
+
+class PoolStats:
+    """Request and connection counters for one replica's client."""
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections_opened = 0
+
+    async def trace(self, event_name: str, info: Dict[str, Any]):
+        """httpx trace hook; counts the TCP connections the pool actually had to open."""
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+class CircuitBreaker:
+    """
+    Per-replica circuit breaker. After enough consecutive failures the circuit
+    opens and the replica receives no traffic; once the cooldown has passed a
+    single trial request is allowed (half-open), and its outcome closes or
+    re-opens the circuit.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+
+    def available(self) -> bool:
+        """Whether allow() would currently let a request through, without claiming the trial slot."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self._trial_in_flight
+
+    def allow(self) -> bool:
+        """Claims permission for one request; in the half-open state only one request at a time gets it."""
+        if not self.available():
+            return False
+        if self.state != self.CLOSED:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def release(self):
+        """Gives back a trial slot whose request ended without an outcome (e.g. it was cancelled)."""
+        self._trial_in_flight = False
+
+class Replica:
+    """One instance of a downstream service: its pooled client, counters and circuit breaker."""
+    def __init__(self, url: str, client_factory: Callable[[str], httpx.AsyncClient]):
+        self.url = url
+        self.stats = PoolStats()
+        self.breaker = CircuitBreaker()
+        self._client_factory = client_factory
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared client for this replica, created on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = self._client_factory(self.url)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        entry = {
+            "base_url": self.url,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "times_opened": self.breaker.times_opened,
+            "requests": self.stats.requests,
+            "errors": self.stats.errors,
+            "in_flight": self.stats.in_flight,
+            "max_in_flight": self.stats.max_in_flight,
+            "connections_opened": self.stats.connections_opened,
+        }
+        # httpx does not expose its pool publicly; read it defensively from the transport
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        if pool is not None:
+            connections = list(pool.connections)
+            entry["connections_open"] = len(connections)
+            entry["connections_idle"] = sum(1 for conn in connections if conn.is_idle())
+        return entry
+
+class ReplicaSet:
+    """
+    The replicas of one service. Requests go to the replica with the fewest
+    outstanding requests among those whose circuit lets traffic through.
+    Successful latencies are kept per endpoint to drive request hedging.
+    """
+    def __init__(self, name: str, urls: List[str], client_factory: Callable[[str], httpx.AsyncClient]):
+        if not urls:
+            raise ValueError(f"No replica URLs configured for the {name} service.")
+        self.name = name
+        self.replicas = [Replica(url, client_factory) for url in urls]
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def pick(self, exclude: Iterable[Replica] = ()) -> Replica:
+        """
+        Returns the least-loaded replica that accepts traffic and claims it.
+
+        Raises:
+            NoHealthyReplicaError: If no replica outside `exclude` is available.
+        """
+        excluded = set(map(id, exclude))
+        candidates = [replica for replica in self.replicas if id(replica) not in excluded]
+        # Ties go to the replica that has served fewer requests, so idle replicas share the load
+        for replica in sorted(candidates, key=lambda r: (r.stats.in_flight, r.stats.requests)):
+            if replica.breaker.allow():
+                return replica
+        raise NoHealthyReplicaError(f"No healthy {self.name} replica available.")
+
+    def available(self) -> List[Replica]:
+        """Replicas that currently accept traffic, e.g. to broadcast a dataset upload to."""
+        return [replica for replica in self.replicas if replica.breaker.available()]
+
+    def record_latency(self, endpoint: str, seconds: float):
+        window = self.latencies.get(endpoint)
+        if window is None:
+            window = self.latencies[endpoint] = deque(maxlen=LATENCY_WINDOW)
+        window.append(seconds)
+
+    def p95(self, endpoint: str) -> Optional[float]:
+        """The endpoint's recent 95th-percentile latency, or None until enough samples exist."""
+        window = self.latencies.get(endpoint)
+        if window is None or len(window) < LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(window)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+    async def aclose(self):
+        for replica in self.replicas:
+            await replica.aclose()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "replicas": [replica.to_dict() for replica in self.replicas],
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "p95_ms": {
+                endpoint: round(1000 * p95, 3)
+                for endpoint in self.latencies
+                if (p95 := self.p95(endpoint)) is not None
+            },
+        }
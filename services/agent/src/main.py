@@ -1,12 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI, WebSocket
-from .websocket_handler import websocket_endpoint
+from fastapi.responses import Response
+from common import log, metrics, tracing
+from .websocket_handler import manager, websocket_endpoint
+from . import result_cache, tool_registry
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Opens the pooled downstream HTTP clients (or, in monolith mode, loads the
+    EDA/ML services in-process) and starts the event-loop lag monitor on
+    startup; stops both on shutdown.
+    """
+    await tool_registry.open_clients()
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    yield
+    lag_monitor.cancel()
+    await tool_registry.close_clients()
 
 # Create the FastAPI app instance
 app = FastAPI(
     title="CanvasLytics Agent Orchestrator",
     description="Handles client communication and orchestrates calls to backend microservices.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
+app.add_middleware(metrics.MetricsMiddleware)
+tracing.set_service("agent")
 
 @app.get("/", tags=["Health Check"])
 async def read_root():
@@ -15,10 +37,43 @@ async def read_root():
     """
     return {"status": "ok", "message": "Agent service is running"}
 
+@app.get("/stats", tags=["Diagnostics"])
+async def read_stats():
+    """
+    Returns connection-pool counters for each downstream service, result cache
+    statistics, how many EDA calls were coalesced and admission-control
+    queue depths and rejections.
+    """
+    return {
+        "status": "ok",
+        "http_pools": tool_registry.get_pool_stats(),
+        "result_cache": result_cache.cache.stats(),
+        "single_flight": tool_registry.get_single_flight_stats(),
+        "admission": manager.stats(),
+        "log_records_dropped": log.dropped_records(),
+    }
+
+@app.get("/metrics", tags=["Diagnostics"])
+async def read_metrics():
+    """
+    Prometheus metrics: per-action and upstream latencies, WebSocket message sizes,
+    connections, admission queue depth and event-loop lag.
+    """
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/debug/traces", tags=["Diagnostics"])
+async def read_traces(trace_id: Optional[str] = None, limit: int = 20):
+    """
+    Returns recent traces recorded by the agent (one per WebSocket message), or
+    only the spans of `trace_id`; the EDA/ML services serve their spans of the
+    same trace at their own /debug/traces.
+    """
+    return {"status": "ok", "traces": tracing.traces(trace_id, limit)}
+
 @app.websocket("/ws/{client_id}")
 async def ws_endpoint(websocket: WebSocket, client_id: str):
     """
     WebSocket route for real-time communication with the client.
     The client_id can be used to manage sessions.
     """
-    await websocket_endpoint(websocket, client_id)
\ No newline at end of file
+    await websocket_endpoint(websocket, client_id)
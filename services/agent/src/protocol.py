@@ -0,0 +1,41 @@
+import msgpack
+import orjson
+from typing import Any, Iterable, Optional, Union
+from common import fast_json
+
+# WebSocket subprotocol for binary MessagePack frames. Clients that do not request
+# it keep the original JSON text protocol.
+MSGPACK_SUBPROTOCOL = "canvaslytics.msgpack.v1"
+
+def negotiate(requested: Iterable[str]) -> Optional[str]:
+    """Picks the subprotocol to accept from the client's offer; None means JSON text frames."""
+    return MSGPACK_SUBPROTOCOL if MSGPACK_SUBPROTOCOL in requested else None
+
+def decode_request(frame: Union[str, bytes]) -> Any:
+    """
+    Decodes a client frame: text frames are JSON, binary frames are MessagePack.
+
+    Raises:
+        ValueError: If the frame cannot be decoded.
+    """
+    if isinstance(frame, bytes):
+        try:
+            return msgpack.unpackb(frame, raw=False)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError):
+            raise ValueError("Invalid MessagePack message received.")
+    try:
+        return orjson.loads(frame)
+    except orjson.JSONDecodeError:
+        raise ValueError("Invalid JSON message received.")
+
+def encode_json(message: Any) -> str:
+    """
+    Encodes a message as a JSON text frame. Chart images arrive from the EDA
+    service as raw bytes ('image'); this is the only place they are base64
+    encoded, under 'image_base64'.
+    """
+    return fast_json.dumps(message).decode()
+
+def encode_msgpack(message: Any) -> bytes:
+    """Encodes a message as a MessagePack binary frame; chart images are sent as the raw bytes they arrived as."""
+    return fast_json.msgpack_dumps(message)
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import orjson
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from common import caching, fast_json
+
+# Tool results are reused for this long; dataset ids are content hashes, so changed data never hits stale entries
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "600"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Optional on-disk tier; leave RESULT_CACHE_DIR empty to keep the cache in memory only
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Results are stored as MessagePack; files of other formats in RESULT_CACHE_DIR are ignored
+RESULT_FILE_SUFFIX = ".msgpack"
+
+# Payload keys that identify the dataset rather than the action's parameters
+DATASET_KEYS = ("data", "dataset_id")
+
+def fingerprint(value: Any) -> str:
+    """Returns a stable hash of a JSON-compatible value; dict key order does not matter."""
+    encoded = orjson.dumps(value, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return hashlib.sha256(encoded).hexdigest()
+
+def cache_key(action: str, payload: Dict[str, Any]) -> str:
+    """
+    Builds the cache key for an action: the action name, a fingerprint of the
+    dataset (its content-addressed dataset_id, or a hash of the inline records)
+    and the remaining parameters with their keys sorted.
+    """
+    dataset = payload.get("dataset_id") or fingerprint(payload.get("data"))
+    params = {key: value for key, value in payload.items() if key not in DATASET_KEYS}
+    return fingerprint([action, dataset, params])
+
+class ResultCache:
+    """
+    Two-tier cache of tool results, stored as MessagePack so chart images stay raw bytes.
+
+    The memory tier is an LRU bounded by bytes with a per-entry TTL. When a
+    directory is configured, results are also written through to disk (bounded
+    by bytes, oldest files removed first), so they survive agent restarts.
+    Memory-tier methods run on the event loop; disk I/O runs in worker threads.
+    """
+    def __init__(
+        self,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        disk_dir: str = RESULT_CACHE_DIR,
+        disk_max_bytes: int = RESULT_CACHE_DISK_MAX_BYTES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._disk = caching.DiskLRU(disk_dir, disk_max_bytes, RESULT_FILE_SUFFIX) if disk_dir else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns a fresh copy of the cached result, or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, blob = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += len(blob)
+                return fast_json.msgpack_loads(blob)
+            self._remove(key)
+
+        if self._disk is not None:
+            blob = await asyncio.to_thread(self._disk.read, key, self.ttl_seconds)
+            if blob is not None:
+                self.disk_hits += 1
+                self.bytes_saved += len(blob)
+                self._store(key, blob)
+                return fast_json.msgpack_loads(blob)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, result: Dict[str, Any]):
+        """Caches a result in memory and, if enabled, on disk."""
+        blob = fast_json.msgpack_dumps(result)
+        self._store(key, blob)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.write, key, blob)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk_entries": len(self._disk) if self._disk is not None else 0,
+            "disk_bytes": self._disk.bytes if self._disk is not None else 0,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else None,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def _store(self, key: str, blob: bytes):
+        if len(blob) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (time.time() + self.ttl_seconds, blob)
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+# Process-wide cache used by the orchestrator
+cache = ResultCache()
@@ -1,18 +1,76 @@
+import asyncio
 import httpx
+import msgpack
+import orjson
 import os
+import time
+from collections import OrderedDict
+from contextlib import aclosing, asynccontextmanager
 from dotenv import load_dotenv
-from typing import Dict, Any
+from urllib.parse import quote
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+from common import arrow_ipc, caching, fast_json, log, metrics, tracing
+from . import inprocess, result_cache
+from .load_balancer import NoHealthyReplicaError, PoolStats, Replica, ReplicaSet
 
 # Load environment variables from a .env file for local development
 load_dotenv()
 
-# Get service URLs from environment variables, with sensible defaults for Docker networking
+logger = log.get_logger("agent.tools")
+
+UPSTREAM_SECONDS = metrics.histogram(
+    "canvaslytics_agent_upstream_request_duration_seconds",
+    "Latency of calls from the agent to the EDA/ML services, by service, endpoint and outcome.",
+    ("service", "endpoint", "outcome"),
+)
+
+# Get service URLs from environment variables, with sensible defaults for Docker networking.
+# Each may list several replicas, separated by commas.
 PANDAS_EDA_URL = os.getenv("PANDAS_EDA_URL", "http://pandas-eda:8001")
 SKLEARN_LAB_URL = os.getenv("SKLEARN_LAB_URL", "http://sklearn-lab:8002")
 
 # Set a timeout for the HTTP requests
 TIMEOUT = httpx.Timeout(30.0, connect=5.0)
 
+# Connection pool settings for the long-lived per-replica clients
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30.0"))
+# HTTP/2 is only negotiated over TLS (e.g. behind the Render proxy); plain http:// stays on HTTP/1.1
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Wire format used to upload datasets to the services: 'json' records or columnar 'arrow' IPC
+DATASET_WIRE_FORMAT = os.getenv("DATASET_WIRE_FORMAT", "json").lower()
+
+# Send a second copy of an EDA call to another replica when the first exceeds the endpoint's p95 latency
+HEDGE_EDA_REQUESTS = os.getenv("HEDGE_EDA_REQUESTS", "false").lower() in ("1", "true", "yes")
+
+# 'http' calls the EDA/ML services over the network; 'inprocess' (monolith mode) runs their
+# handlers inside the agent, sharing DataFrames by reference. Both need the same image.
+TOOL_DISPATCH = os.getenv("TOOL_DISPATCH", "http").lower()
+IN_PROCESS = TOOL_DISPATCH == "inprocess"
+
+# Services asked for MessagePack responses, so chart images arrive as raw bytes rather than base64 JSON
+BINARY_RESPONSE_SERVICES = ("eda",)
+
+# Upstream statuses that mean the replica itself is unhealthy, as opposed to a rejected request
+REPLICA_FAILURE_STATUSES = (502, 503, 504)
+
+LIMITS = httpx.Limits(
+    max_connections=MAX_CONNECTIONS,
+    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=KEEPALIVE_EXPIRY,
+)
+
+def _split_urls(value: str) -> List[str]:
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+# Downstream services keyed by a short name: (display name, replica base URLs)
+SERVICES = {
+    "eda": ("EDA", _split_urls(PANDAS_EDA_URL)),
+    "ml": ("ML", _split_urls(SKLEARN_LAB_URL)),
+}
+
 class ToolError(Exception):
     """Custom exception for tool-related errors."""
     def __init__(self, message, status_code=500):
@@ -20,31 +78,362 @@ class ToolError(Exception):
         self.status_code = status_code
         super().__init__(self.message)
 
-async def call_eda_service(endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+_replica_sets: Dict[str, ReplicaSet] = {}
+_eda_flights = caching.SingleFlight()
+# Training jobs live in the memory of the ML replica that accepted them: job id -> that replica
+_job_replicas: "OrderedDict[str, Replica]" = OrderedDict()
+MAX_TRACKED_JOBS = 10_000
+
+def _create_client(base_url: str) -> httpx.AsyncClient:
+    """Builds the pooled client for one replica."""
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=TIMEOUT,
+        limits=LIMITS,
+        http2=HTTP2_ENABLED,
+    )
+
+def get_replica_set(service: str) -> ReplicaSet:
+    """Returns the replicas of a service, creating them if startup has not run (e.g. in scripts)."""
+    replicas = _replica_sets.get(service)
+    if replicas is None:
+        name, urls = SERVICES[service]
+        replicas = _replica_sets[service] = ReplicaSet(name, urls, _create_client)
+    return replicas
+
+async def open_clients():
+    """Creates one shared client per downstream replica, or loads the services in monolith mode. Called at app startup."""
+    if IN_PROCESS:
+        await inprocess.start()
+        return
+    for service in SERVICES:
+        for replica in get_replica_set(service).replicas:
+            replica.client
+
+async def close_clients():
+    """Closes the shared clients and their pooled connections. Called at app shutdown."""
+    if IN_PROCESS:
+        inprocess.stop()
+    while _replica_sets:
+        _, replicas = _replica_sets.popitem()
+        await replicas.aclose()
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Returns per-replica request counters, circuit state and connection pools, plus
+    hedging counters; in monolith mode, the shared dataset store and worker pools.
+    """
+    if IN_PROCESS:
+        return {"dispatch": TOOL_DISPATCH, **inprocess.stats()}
+    stats = {}
+    for service, (name, _) in SERVICES.items():
+        stats[name] = {"http2_enabled": HTTP2_ENABLED, **get_replica_set(service).to_dict()}
+    return stats
+
+@asynccontextmanager
+async def _tracked(replicas: ReplicaSet, replica: Replica, endpoint: str, method: str = "POST") -> AsyncIterator[PoolStats]:
+    """
+    Counts a request against the replica's stats, records it as a client span,
+    feeds its outcome to the replica's circuit breaker and maps httpx failures
+    to ToolError.
+    """
+    counters = replica.stats
+    counters.requests += 1
+    counters.in_flight += 1
+    counters.max_in_flight = max(counters.max_in_flight, counters.in_flight)
+    try:
+        with tracing.span(f"{method} {endpoint}", service=replicas.name, url=replica.url):
+            yield counters
+    except httpx.HTTPStatusError as e:
+        counters.errors += 1
+        if e.response.status_code in REPLICA_FAILURE_STATUSES:
+            replica.breaker.record_failure()
+        else:
+            replica.breaker.record_success()
+        raise ToolError(f"{replicas.name} service returned an error: {e.response.text}", status_code=e.response.status_code)
+    except httpx.RequestError as e:
+        counters.errors += 1
+        replica.breaker.record_failure()
+        raise ToolError(f"Failed to connect to {replicas.name} service at {replica.url}: {e}")
+    except BaseException:
+        # Cancelled (e.g. a hedged request that lost the race): no verdict on the replica
+        replica.breaker.release()
+        raise
+    else:
+        replica.breaker.record_success()
+    finally:
+        counters.in_flight -= 1
+
+def _headers(content_type: Optional[str] = None, service: Optional[str] = None) -> Dict[str, str]:
+    """Request headers for a downstream call, carrying the current request id and trace context."""
+    headers = tracing.inject({})
+    request_id = log.request_id_var.get()
+    if request_id is not None:
+        headers[log.REQUEST_ID_HEADER] = request_id
+    if content_type is not None:
+        headers["Content-Type"] = content_type
+    if service in BINARY_RESPONSE_SERVICES:
+        headers["Accept"] = f"{fast_json.MSGPACK_MEDIA_TYPE}, application/json"
+    return headers
+
+def _is_msgpack(response: httpx.Response) -> bool:
+    return response.headers.get("content-type", "").startswith(fast_json.MSGPACK_MEDIA_TYPE)
+
+def _decode(response: httpx.Response) -> Dict[str, Any]:
+    """Decodes a MessagePack or JSON response body."""
+    return fast_json.msgpack_loads(response.content) if _is_msgpack(response) else response.json()
+
+def _path(endpoint: str, path_params: Optional[Dict[str, str]]) -> str:
+    """Fills in a route template such as '/jobs/{job_id}'; metrics and spans keep the template."""
+    if not path_params:
+        return endpoint
+    return endpoint.format(**{name: quote(str(value), safe="") for name, value in path_params.items()})
+
+def _pick(replicas: ReplicaSet, exclude: Iterable[Replica] = ()) -> Replica:
+    try:
+        return replicas.pick(exclude)
+    except NoHealthyReplicaError as e:
+        raise ToolError(str(e), status_code=503)
+
+async def _post(
+    service: str,
+    endpoint: str,
+    payload: Optional[Dict[str, Any]] = None,
+    content: Optional[bytes] = None,
+    content_type: Optional[str] = None,
+    replica: Optional[Replica] = None,
+    method: str = "POST",
+    path_params: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """
+    Sends a JSON payload, or a raw body of the given content type, to one
+    replica of the service (the least-loaded healthy one unless given) and
+    returns the JSON response. `endpoint` may be a route template filled in
+    from path_params.
+    """
+    replicas = get_replica_set(service)
+    if replica is None:
+        replica = _pick(replicas)
+    client = replica.client
+    started_at = time.perf_counter()
+    outcome = "error"
+    try:
+        async with _tracked(replicas, replica, endpoint, method) as counters:
+            if content is None:
+                logger.info(
+                    "Calling service",
+                    extra={"service": replicas.name, "url": replica.url, "endpoint": endpoint, "payload": log.summarize(payload)},
+                )
+                response = await client.request(
+                    method,
+                    _path(endpoint, path_params),
+                    json=payload,
+                    headers=_headers(service=service),
+                    extensions={"trace": counters.trace},
+                )
+            else:
+                logger.info(
+                    "Calling service",
+                    extra={
+                        "service": replicas.name,
+                        "url": replica.url,
+                        "endpoint": endpoint,
+                        "bytes": len(content),
+                        "content_type": content_type,
+                    },
+                )
+                response = await client.request(
+                    method,
+                    _path(endpoint, path_params),
+                    content=content,
+                    headers=_headers(content_type, service),
+                    extensions={"trace": counters.trace},
+                )
+            response.raise_for_status()  # Raises HTTPStatusError for 4xx/5xx responses
+            result = _decode(response)
+            outcome = "success"
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started_at
+        UPSTREAM_SECONDS.labels(replicas.name, endpoint, outcome).observe(elapsed)
+    replicas.record_latency(endpoint, elapsed)
+    return result
+
+async def _call_in_process(
+    service: str,
+    endpoint: str,
+    payload: Optional[Dict[str, Any]] = None,
+    method: str = "POST",
+    path_params: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Runs a service route inside the agent (monolith mode), timed and traced like an upstream call."""
+    name = SERVICES[service][0]
+    started_at = time.perf_counter()
+    outcome = "error"
+    try:
+        with tracing.span(f"{method} {endpoint}", service=name, dispatch=TOOL_DISPATCH):
+            result = await inprocess.call(service, endpoint, payload, path_params)
+        outcome = "success"
+        return result
+    except inprocess.InProcessError as e:
+        raise ToolError(f"{name} service returned an error: {e.body}", status_code=e.status_code)
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        UPSTREAM_SECONDS.labels(name, endpoint, outcome).observe(time.perf_counter() - started_at)
+
+async def _post_hedged(service: str, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Posts an idempotent call and, if it has not answered within the endpoint's
+    recent p95 latency, sends the same call to a second replica. The first
+    successful response wins and the other request is cancelled.
+    """
+    replicas = get_replica_set(service)
+    delay = replicas.p95(endpoint)
+    if delay is None or len(replicas.replicas) < 2:
+        return await _post(service, endpoint, payload)
+
+    primary_replica = _pick(replicas)
+    primary = asyncio.ensure_future(_post(service, endpoint, payload, replica=primary_replica))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return primary.result()
+        try:
+            backup_replica = replicas.pick(exclude=[primary_replica])
+        except NoHealthyReplicaError:
+            return await primary
+        replicas.hedges_sent += 1
+        backup = asyncio.ensure_future(_post(service, endpoint, payload, replica=backup_replica))
+        tasks.append(backup)
+
+        pending, first_error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        replicas.hedges_won += 1
+                    return task.result()
+                first_error = first_error or task.exception()
+        raise first_error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def _stream(
+    service: str,
+    endpoint: str,
+    payload: Optional[Dict[str, Any]] = None,
+    method: str = "POST",
+    path_params: Optional[Dict[str, str]] = None,
+    replica: Optional[Replica] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Sends a JSON payload and yields each event of the service's NDJSON (or
+    MessagePack) response as it arrives.
+    """
+    if IN_PROCESS:
+        events = inprocess.stream(service, endpoint, payload, path_params)
+        try:
+            with tracing.span(f"{method} {endpoint}", service=SERVICES[service][0], dispatch=TOOL_DISPATCH):
+                async for event in events:
+                    yield event
+        except inprocess.InProcessError as e:
+            raise ToolError(f"{SERVICES[service][0]} service returned an error: {e.body}", status_code=e.status_code)
+        finally:
+            await events.aclose()
+        return
+    replicas = get_replica_set(service)
+    if replica is None:
+        replica = _pick(replicas)
+    async with _tracked(replicas, replica, endpoint, method) as counters:
+        logger.info(
+            "Streaming from service",
+            extra={"service": replicas.name, "url": replica.url, "endpoint": endpoint, "payload": log.summarize(payload)},
+        )
+        async with replica.client.stream(
+            method,
+            _path(endpoint, path_params),
+            json=payload,
+            headers=_headers(service=service),
+            extensions={"trace": counters.trace},
+        ) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            if _is_msgpack(response):
+                # Events are back-to-back MessagePack objects; each is yielded once fully received
+                unpacker = msgpack.Unpacker(raw=False)
+                async for chunk in response.aiter_bytes():
+                    unpacker.feed(chunk)
+                    for event in unpacker:
+                        yield event
+                return
+            async for line in response.aiter_lines():
+                if line:
+                    yield orjson.loads(line)
+
+async def call_eda_service(
+    endpoint: str, payload: Dict[str, Any], fingerprint: Optional[str] = None
+) -> Dict[str, Any]:
     """
     Asynchronously calls an endpoint on the pandas-eda service.
 
+    EDA calls are idempotent, so concurrent identical calls (same endpoint and
+    payload) share a single upstream request, and with HEDGE_EDA_REQUESTS a
+    slow call is duplicated to a second replica.
+
     Args:
         endpoint (str): The specific API endpoint to hit (e.g., '/summarize').
         payload (Dict): The data to send in the request body.
+        fingerprint (str, optional): A hash that uniquely identifies the payload,
+            if the caller already computed one; otherwise it is computed here.
 
     Returns:
         A dictionary containing the JSON response from the service.
-    
+
     Raises:
         ToolError: If the API call fails or returns a non-200 status code.
     """
-    url = f"{PANDAS_EDA_URL}{endpoint}"
-    async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-        try:
-            print(f"Calling EDA service at {url} with payload: {payload}")
-            response = await client.post(url, json=payload)
-            response.raise_for_status()  # Raises HTTPStatusError for 4xx/5xx responses
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            raise ToolError(f"EDA service returned an error: {e.response.text}", status_code=e.response.status_code)
-        except httpx.RequestError as e:
-            raise ToolError(f"Failed to connect to EDA service: {e}")
+    if fingerprint is None:
+        if "data" in payload:
+            # Hashing inline records is proportional to the dataset; keep it off the event loop
+            fingerprint = await asyncio.to_thread(result_cache.fingerprint, payload)
+        else:
+            fingerprint = result_cache.fingerprint(payload)
+    if IN_PROCESS:
+        post = _call_in_process
+    else:
+        post = _post_hedged if HEDGE_EDA_REQUESTS else _post
+    return await _eda_flights.do(f"{endpoint}:{fingerprint}", lambda: post("eda", endpoint, payload))
+
+def get_single_flight_stats() -> Dict[str, Any]:
+    """Returns how many EDA calls led an upstream request and how many joined one already in flight."""
+    return _eda_flights.stats()
+
+async def stream_eda_service(endpoint: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Calls a streaming (NDJSON) endpoint on the pandas-eda service.
+
+    Args:
+        endpoint (str): The streaming API endpoint (e.g., '/initial-visualizations/stream').
+        payload (Dict): The data to send in the request body.
+
+    Yields:
+        Each event emitted by the service, as soon as it is received.
+
+    Raises:
+        ToolError: If the API call fails or returns a non-200 status code.
+    """
+    # Close the inner stream here, in this task, rather than leaving it to the garbage collector
+    async with aclosing(_stream("eda", endpoint, payload)) as events:
+        async for event in events:
+            yield event
 
 async def call_ml_service(endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -60,14 +449,140 @@ async def call_ml_service(endpoint: str, payload: Dict[str, Any]) -> Dict[str, A
     Raises:
         ToolError: If the API call fails or returns a non-200 status code.
     """
-    url = f"{SKLEARN_LAB_URL}{endpoint}"
-    async with httpx.AsyncClient(timeout=TIMEOUT) as client:
+    if IN_PROCESS:
+        return await _call_in_process("ml", endpoint, payload)
+    return await _post("ml", endpoint, payload)
+
+async def register_dataset(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Uploads a dataset once to every replica of every service that computes on
+    it, so later actions can send its dataset_id instead of the records. With
+    DATASET_WIRE_FORMAT=arrow the records are encoded once as an Arrow IPC
+    stream and sent to /datasets/arrow instead of as JSON.
+
+    Replicas whose circuit is open are skipped; a replica that misses the
+    upload answers later calls for this dataset with a 404. In monolith mode
+    both services share one dataset store, so the dataset is stored once.
+
+    Returns:
+        The registration response, including the shared 'dataset_id'.
+
+    Raises:
+        ToolError: If no replica of a service accepts the dataset.
+    """
+    if IN_PROCESS:
+        return await _call_in_process("eda", "/datasets", payload)
+
+    body = None
+    if DATASET_WIRE_FORMAT == "arrow":
         try:
-            print(f"Calling ML service at {url} with payload: {payload}")
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            raise ToolError(f"ML service returned an error: {e.response.text}", status_code=e.response.status_code)
-        except httpx.RequestError as e:
-            raise ToolError(f"Failed to connect to ML service: {e}")
\ No newline at end of file
+            body = await asyncio.to_thread(arrow_ipc.arrow_stream_from_records, payload.get("data") or [])
+        except (ValueError, TypeError) as e:
+            logger.warning("Could not encode dataset as Arrow, sending JSON records instead", extra={"error": str(e)})
+
+    targets = []
+    for service in ("eda", "ml"):
+        replicas = get_replica_set(service)
+        # allow() claims the trial request of a half-open replica, as pick() does for single calls
+        claimed = [replica for replica in replicas.available() if replica.breaker.allow()]
+        if not claimed:
+            for _, replica in targets:
+                replica.breaker.release()
+            raise ToolError(f"No healthy {replicas.name} replica available.", status_code=503)
+        targets.extend((service, replica) for replica in claimed)
+
+    if body is not None:
+        uploads = [
+            _post(service, "/datasets/arrow", content=body, content_type=arrow_ipc.ARROW_STREAM_MEDIA_TYPE, replica=replica)
+            for service, replica in targets
+        ]
+    else:
+        uploads = [_post(service, "/datasets", payload, replica=replica) for service, replica in targets]
+    results = await asyncio.gather(*uploads, return_exceptions=True)
+
+    accepted: Dict[str, List[Dict[str, Any]]] = {service: [] for service in SERVICES}
+    for (service, replica), result in zip(targets, results):
+        if isinstance(result, ToolError):
+            logger.warning("Replica did not accept the dataset", extra={"url": replica.url, "error": result.message})
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            accepted[service].append(result)
+    for service, responses in accepted.items():
+        if not responses:
+            failures = [result for (target, _), result in zip(targets, results) if target == service]
+            raise failures[0]
+
+    dataset_ids = {result.get("dataset_id") for responses in accepted.values() for result in responses}
+    if len(dataset_ids) != 1:
+        raise ToolError("EDA and ML services computed different dataset ids.")
+    return accepted["eda"][0]
+
+async def submit_training_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Queues a training job on the sklearn-lab service.
+
+    Args:
+        payload (Dict): The same fields as a '/train' request.
+
+    Returns:
+        The service response, with the queued job under 'job'.
+
+    Raises:
+        ToolError: If the request is invalid or the job queue is full (429).
+    """
+    if IN_PROCESS:
+        return await _call_in_process("ml", "/jobs/train", payload)
+    replica = _pick(get_replica_set("ml"))
+    result = await _post("ml", "/jobs/train", payload, replica=replica)
+    _job_replicas[result["job"]["job_id"]] = replica
+    while len(_job_replicas) > MAX_TRACKED_JOBS:
+        _job_replicas.popitem(last=False)
+    return result
+
+def _job_replica(job_id: str) -> Replica:
+    replica = _job_replicas.get(job_id)
+    if replica is None:
+        replicas = get_replica_set("ml").replicas
+        # With a single replica the job can only be there, e.g. after an agent restart
+        if len(replicas) != 1:
+            raise ToolError(f"Training job '{job_id}' is unknown to this agent.", status_code=404)
+        replica = replicas[0]
+    return replica
+
+async def _call_job(job_id: str, endpoint: str, method: str) -> Dict[str, Any]:
+    path_params = {"job_id": job_id}
+    if IN_PROCESS:
+        return await _call_in_process("ml", endpoint, method=method, path_params=path_params)
+    return await _post("ml", endpoint, replica=_job_replica(job_id), method=method, path_params=path_params)
+
+async def get_training_job(job_id: str) -> Dict[str, Any]:
+    """Returns a training job's state and progress."""
+    return await _call_job(job_id, "/jobs/{job_id}", "GET")
+
+async def get_training_job_result(job_id: str) -> Dict[str, Any]:
+    """
+    Returns the metrics and model artifact of a succeeded training job.
+
+    Raises:
+        ToolError: With status 409 if the job has not succeeded.
+    """
+    return await _call_job(job_id, "/jobs/{job_id}/result", "GET")
+
+async def cancel_training_job(job_id: str) -> Dict[str, Any]:
+    """Cancels a queued or running training job and returns its final state."""
+    return await _call_job(job_id, "/jobs/{job_id}/cancel", "POST")
+
+async def stream_training_job(job_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yields a training job's events (state and progress changes, heartbeats)
+    until it finishes.
+
+    Raises:
+        ToolError: If the job is unknown or the stream fails.
+    """
+    replica = None if IN_PROCESS else _job_replica(job_id)
+    events = _stream("ml", "/jobs/{job_id}/events", method="GET", path_params={"job_id": job_id}, replica=replica)
+    async with aclosing(events):
+        async for event in events:
+            yield event
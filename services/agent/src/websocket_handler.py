@@ -1,46 +1,182 @@
-from typing import List
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Union
 from fastapi import WebSocket, WebSocketDisconnect
+from starlette.websockets import WebSocketState
+from common import log, metrics, tracing
+from . import admission, protocol
 from .agent_orchestrator import AgentOrchestrator
 
+logger = log.get_logger("agent.websocket")
+
+WS_MESSAGE_BYTES = metrics.histogram(
+    "canvaslytics_agent_ws_message_size_bytes",
+    "WebSocket frame sizes, by direction (in/out).",
+    ("direction",),
+    metrics.BYTES_BUCKETS,
+)
+
+# Close code sent to connections beyond MAX_CONNECTIONS ("Try Again Later")
+WS_TRY_AGAIN_LATER = 1013
+
+class ClientSession:
+    """
+    State for one WebSocket connection: the negotiated wire protocol, the
+    in-flight message tasks, the connection's admission limiter and a lock
+    that keeps concurrent tasks from interleaving their sends on the socket.
+    """
+    def __init__(self, websocket: WebSocket, client_id: str, subprotocol: Optional[str] = None):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.binary = subprotocol == protocol.MSGPACK_SUBPROTOCOL
+        self.send_lock = asyncio.Lock()
+        self.limiter = admission.client_limiter()
+        self.tasks: Set[asyncio.Task] = set()
+        self.closed = False
+
+    async def send(self, message: Dict[str, Any]):
+        """
+        Sends one message as a MessagePack binary frame or a JSON text frame,
+        depending on the negotiated protocol; messages are written to the socket
+        one at a time, in call order.
+        """
+        with tracing.span("encode", binary=self.binary) as span:
+            frame = protocol.encode_msgpack(message) if self.binary else protocol.encode_json(message)
+            span.set(bytes=len(frame))
+        WS_MESSAGE_BYTES.labels("out").observe(len(frame))
+        with tracing.span("send"):
+            async with self.send_lock:
+                if self.binary:
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+
+    def is_open(self) -> bool:
+        """True until the client disconnects."""
+        return not self.closed and self.websocket.client_state == WebSocketState.CONNECTED
+
+    def submit(self, handler: Callable[..., Awaitable[None]], *args):
+        """Runs handler(*args) as its own task; admission limits are applied by the handler."""
+        self.track(asyncio.create_task(handler(*args)))
+
+    def track(self, task: asyncio.Task):
+        """Ties a task to the connection, so cancel_all cancels it; cancelled at once if already closed."""
+        if self.closed:
+            task.cancel()
+            return
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def cancel_all(self):
+        """Cancels every in-flight and background task, e.g. when the client disconnects."""
+        self.closed = True
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
 class ConnectionManager:
     """Manages active WebSocket connections."""
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: List[ClientSession] = []
         self.orchestrator = AgentOrchestrator()
+        self.rejected_connections = 0
 
-    async def connect(self, websocket: WebSocket):
-        """Accepts a new WebSocket connection."""
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        print(f"New client connected. Total clients: {len(self.active_connections)}")
+    async def connect(self, websocket: WebSocket, client_id: str) -> Optional[ClientSession]:
+        """
+        Accepts a new WebSocket connection, or closes it and returns None when at capacity.
+        Clients that offer the MessagePack subprotocol get binary frames; others get JSON.
+        """
+        subprotocol = protocol.negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        if len(self.active_connections) >= admission.MAX_CONNECTIONS:
+            self.rejected_connections += 1
+            logger.warning(
+                "Rejecting connection at capacity",
+                extra={"client_id": client_id, "connections": len(self.active_connections)},
+            )
+            await websocket.close(code=WS_TRY_AGAIN_LATER, reason="Server busy, retry later")
+            return None
+        session = ClientSession(websocket, client_id, subprotocol)
+        self.active_connections.append(session)
+        logger.info(
+            "Client connected",
+            extra={"client_id": client_id, "connections": len(self.active_connections), "subprotocol": subprotocol},
+        )
+        return session
 
-    def disconnect(self, websocket: WebSocket):
+    def disconnect(self, session: ClientSession):
         """Removes a WebSocket connection."""
-        self.active_connections.remove(websocket)
-        print(f"Client disconnected. Total clients: {len(self.active_connections)}")
+        self.active_connections.remove(session)
+        logger.info(
+            "Client disconnected",
+            extra={"client_id": session.client_id, "connections": len(self.active_connections)},
+        )
 
-    async def handle_message(self, websocket: WebSocket, message: str):
+    async def handle_message(self, session: ClientSession, message: Union[str, bytes]):
         """
-        Receives a message, processes it with the orchestrator, 
-        and sends the result back to the client.
+        Receives a message, processes it with the orchestrator,
+        and sends the result back to the client. Each message starts a new trace.
         """
-        print(f"Received message: {message}")
-        result = await self.orchestrator.process_user_request(message)
-        await websocket.send_json(result)
-        print(f"Sent response: {result}")
+        logger.debug("Received message", extra={"bytes": len(message), "binary": isinstance(message, bytes)})
+        with tracing.span("ws.message", new_trace=True, client_id=session.client_id, bytes=len(message)):
+            result = await self.orchestrator.process_user_request(
+                message,
+                send=session.send,
+                admit=lambda: admission.admit(session.limiter),
+                background=session.track,
+                is_open=session.is_open,
+            )
+            try:
+                await session.send(result)
+            except (WebSocketDisconnect, RuntimeError):
+                # The client left while the request was running; nobody is waiting for the result
+                return
+        logger.info("Sent response", extra={"status": result.get("status"), "result": log.summarize(result)})
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns connection counts and admission queue/rejection counters."""
+        return {
+            "connections": len(self.active_connections),
+            "max_connections": admission.MAX_CONNECTIONS,
+            "rejected_connections": self.rejected_connections,
+            **admission.stats(),
+        }
 
 manager = ConnectionManager()
 
+metrics.gauge(
+    "canvaslytics_agent_ws_connections", "Open WebSocket connections.", function=lambda: len(manager.active_connections)
+)
+metrics.gauge(
+    "canvaslytics_agent_requests_in_flight", "Requests holding a global admission slot.",
+    function=lambda: admission.global_stats.in_flight,
+)
+metrics.gauge(
+    "canvaslytics_agent_admission_queue_depth", "Requests waiting for a global admission slot.",
+    function=lambda: admission.global_stats.waiting,
+)
+
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     """
     The main WebSocket endpoint that clients connect to.
+    Each message is handled as its own task, so a slow action (e.g. training)
+    does not hold up later messages; responses echo the message's request_id.
     """
-    await manager.connect(websocket)
+    session = await manager.connect(websocket, client_id)
+    if session is None:
+        return
     try:
         while True:
-            # Wait for a message from the client
-            message = await websocket.receive_text()
-            await manager.handle_message(websocket, message)
+            # Wait for a message from the client; binary frames carry MessagePack
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            frame = message.get("text")
+            if frame is None:
+                frame = message.get("bytes")
+            WS_MESSAGE_BYTES.labels("in").observe(len(frame))
+            session.submit(manager.handle_message, session, frame)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        print(f"Client #{client_id} disconnected.")
\ No newline at end of file
+        pass
+    finally:
+        await session.cancel_all()
+        manager.disconnect(session)
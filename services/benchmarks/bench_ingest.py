@@ -0,0 +1,86 @@
+"""
+Compares the default FastAPI/Pydantic ingestion of JSON records with the
+orjson fast path in common.fast_json.
+
+Baseline: json.loads -> Pydantic validation of List[Dict[str, Any]] -> .dict() -> pd.DataFrame(records)
+Fast path: orjson.loads -> envelope-only validation -> column-wise DataFrame construction
+
+Run from the directory that contains the service packages (/app in the Docker image):
+
+    python -m benchmarks.bench_ingest --rows 10000,100000,1000000
+"""
+import argparse
+import gc
+import json
+import time
+import numpy as np
+import orjson
+import pandas as pd
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+from common import fast_json
+
+class LegacyChartPayload(BaseModel):
+    # The request model as it was before the fast path: every record is validated
+    data: List[Dict[str, Any]]
+    chart_type: str
+    params: Dict[str, Any] = {}
+
+class ChartPayload(BaseModel):
+    data: Optional[List[Dict[str, Any]]] = None
+    dataset_id: Optional[str] = None
+    chart_type: str
+    params: Dict[str, Any] = {}
+
+def make_body(rows: int, seed: int = 0) -> bytes:
+    """Builds a Titanic-like JSON chart request with numeric, categorical and nullable columns."""
+    rng = np.random.default_rng(seed)
+    ages = rng.normal(30, 12, rows).round(1)
+    frame = pd.DataFrame({
+        "passenger_id": np.arange(rows),
+        "survived": rng.integers(0, 2, rows),
+        "pclass": rng.integers(1, 4, rows),
+        "age": np.where(rng.random(rows) < 0.2, np.nan, ages),
+        "fare": rng.gamma(2.0, 15.0, rows).round(2),
+        "sex": rng.choice(["male", "female"], rows),
+        "embarked": rng.choice(["S", "C", "Q"], rows),
+    })
+    records = frame.to_dict("records")
+    for record in records:
+        if record["age"] != record["age"]:
+            record["age"] = None
+    return orjson.dumps({"data": records, "chart_type": "histogram", "params": {"column": "age"}})
+
+def baseline(body: bytes) -> pd.DataFrame:
+    payload = LegacyChartPayload(**json.loads(body))
+    return pd.DataFrame(payload.model_dump()["data"])
+
+def fast_path(body: bytes) -> pd.DataFrame:
+    payload = fast_json.parse_envelope(body, ChartPayload)
+    return fast_json.dataframe_from_records(payload.data)
+
+def best_of(fn, body: bytes, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn(body)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000,1000000", help="Comma-separated row counts.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size; the best time is reported.")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'payload MB':>11} {'baseline s':>11} {'fast s':>9} {'speedup':>8}")
+    for rows in (int(value) for value in args.rows.split(",")):
+        body = make_body(rows)
+        assert baseline(body).equals(fast_path(body)), "fast path produced a different DataFrame"
+        slow = best_of(baseline, body, args.repeat)
+        fast = best_of(fast_path, body, args.repeat)
+        print(f"{rows:>10} {len(body) / 1e6:>11.1f} {slow:>11.3f} {fast:>9.3f} {slow / fast:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
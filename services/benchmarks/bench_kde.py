@@ -0,0 +1,91 @@
+"""
+Compares seaborn's exact KDE (scipy gaussian_kde, as sns.histplot(kde=True)
+evaluates it) with the binned FFT estimate in pandas-eda (kde.py).
+
+Both use Scott's bandwidth and the same 200-point support over the data range
+(cut=0, as in histplot). Accuracy is the largest absolute difference between
+the curves relative to the peak density; --render also times a full histogram
+render through each path.
+
+Run from the directory that contains the service packages (/app in the Docker image):
+
+    python -m benchmarks.bench_kde --rows 10000,100000,1000000
+"""
+import argparse
+import gc
+import importlib
+import time
+from typing import Callable, Dict
+import numpy as np
+import pandas as pd
+from seaborn._statistics import KDE
+
+kde = importlib.import_module("pandas-eda.kde")
+tools = importlib.import_module("pandas-eda.tools")
+
+def make_columns(rows: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """Shapes a KDE meets in practice: smooth, multimodal, skewed, discrete and heavy-tailed."""
+    rng = np.random.default_rng(seed)
+    half = rows // 2
+    return {
+        "normal": rng.normal(50, 10, rows),
+        "bimodal": np.concatenate([rng.normal(-3, 1, half), rng.normal(4, 0.5, rows - half)]),
+        "lognormal": rng.lognormal(0, 1, rows),
+        "integers": rng.integers(0, 20, rows).astype("float64"),
+        "pareto": rng.pareto(1.5, rows),
+    }
+
+def exact(x: np.ndarray):
+    density, support = KDE(cut=0)(x)
+    return support, density
+
+def fast(x: np.ndarray):
+    return kde.binned_kde(x, cut=0)
+
+def best_of(fn: Callable, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def render_seconds(df: pd.DataFrame, column: str, threshold: int, repeat: int) -> float:
+    original = kde.KDE_FAST_THRESHOLD
+    kde.KDE_FAST_THRESHOLD = threshold
+    try:
+        return best_of(lambda: tools.generate_histogram(df, column), repeat)
+    finally:
+        kde.KDE_FAST_THRESHOLD = original
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000,1000000", help="Comma-separated row counts.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the best time is reported.")
+    parser.add_argument("--render", action="store_true", help="Also time whole histogram renders.")
+    args = parser.parse_args()
+
+    header = f"{'rows':>9} {'column':<10} {'exact ms':>9} {'fast ms':>8} {'speedup':>8} {'max err':>9}"
+    if args.render:
+        header += f" {'render exact ms':>16} {'render fast ms':>15}"
+    print(header)
+    for rows in (int(value) for value in args.rows.split(",")):
+        for name, x in make_columns(rows).items():
+            support, expected = exact(x)
+            fast_support, estimate = fast(x)
+            assert np.allclose(support, fast_support), "support grids differ"
+            error = np.abs(estimate - expected).max() / expected.max()
+            slow_s = best_of(lambda: exact(x), args.repeat)
+            fast_s = best_of(lambda: fast(x), args.repeat)
+            line = f"{rows:>9} {name:<10} {slow_s * 1e3:>9.1f} {fast_s * 1e3:>8.1f} {slow_s / fast_s:>7.0f}x {error:>9.2e}"
+            if args.render:
+                df = pd.DataFrame({name: x})
+                line += (
+                    f" {render_seconds(df, name, rows + 1, args.repeat) * 1e3:>16.0f}"
+                    f" {render_seconds(df, name, 0, args.repeat) * 1e3:>15.0f}"
+                )
+            print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Compares the former pyplot chart helpers with the object-oriented rendering
+engine in pandas-eda (rendering.py).
+
+Baseline: plt.style.use + plt.subplots per chart, figures closed with plt.close
+Engine:   style applied once, per-thread reusable Figure/Agg canvases
+
+Every tenth request asks for a histogram of a mixed-type column, which seaborn
+rejects part-way through drawing, as happens with messy uploads. The report
+shows median time per chart, resident memory growth over the run and figures
+left open in pyplot. --threads also renders with the engine from several
+threads and checks the images match the single-threaded ones.
+
+Run from the directory that contains the service packages (/app in the Docker image):
+
+    python -m benchmarks.bench_render --charts 200 --rows 20000 --threads 4
+"""
+import argparse
+import gc
+import importlib
+import io
+import os
+import resource
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+tools = importlib.import_module("pandas-eda.tools")
+
+CHARTS = [("histogram", "num_0"), ("bar_chart", "cat_0"), ("heatmap", None), ("histogram", "num_1")]
+BAD_CHART = ("histogram", "mixed")
+
+def legacy_chart(df: pd.DataFrame, chart_type: str, column: Optional[str]) -> bytes:
+    """The chart helpers as they were before the rendering engine."""
+    plt.style.use('seaborn-v0_8-whitegrid')
+    if chart_type == "heatmap":
+        fig, ax = plt.subplots(figsize=(8, 6))
+        sns.heatmap(df.select_dtypes(include=['number']).corr(), annot=True, fmt=".2f", cmap="coolwarm", ax=ax)
+        ax.set_title('Correlation Heatmap')
+    elif chart_type == "histogram":
+        fig, ax = plt.subplots(figsize=(7, 5))
+        sns.histplot(df[column], kde=True, ax=ax)
+        ax.set_title(f'Distribution of {column}')
+        ax.set_xlabel(column)
+        ax.set_ylabel('Frequency')
+    else:
+        fig, ax = plt.subplots(figsize=(7, 5))
+        sns.countplot(y=df[column], ax=ax, order=df[column].value_counts().index)
+        ax.set_title(f'Count of {column}')
+        ax.set_xlabel('Count')
+        ax.set_ylabel(column)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        "num_0": rng.normal(0, 1, rows),
+        "num_1": rng.gamma(2.0, 3.0, rows),
+        "num_2": rng.integers(0, 100, rows),
+        "cat_0": rng.choice([f"level_{i}" for i in range(8)], rows),
+    })
+    # Numbers with stray text, as left by a spreadsheet export
+    frame["mixed"] = pd.Series(rng.normal(0, 1, rows).round(2), dtype=object)
+    frame.loc[::97, "mixed"] = "n/a"
+    return frame
+
+def rss_mb() -> float:
+    """Current resident set size; falls back to the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+def workload(charts: int) -> List[Tuple[str, Optional[str]]]:
+    return [BAD_CHART if i % 10 == 9 else CHARTS[i % len(CHARTS)] for i in range(charts)]
+
+def run(name: str, render: Callable, df: pd.DataFrame, charts: int) -> Dict[str, float]:
+    for chart_type, column in CHARTS:
+        render(df, chart_type, column)  # Warm up fonts and caches
+    gc.collect()
+    start_rss = rss_mb()
+    timings, failures = [], 0
+    for chart_type, column in workload(charts):
+        start = time.perf_counter()
+        try:
+            render(df, chart_type, column)
+        except Exception:
+            failures += 1
+        timings.append(time.perf_counter() - start)
+    gc.collect()
+    return {
+        "name": name,
+        "median_ms": statistics.median(timings) * 1000,
+        "total_s": sum(timings),
+        "rss_growth_mb": rss_mb() - start_rss,
+        "failures": failures,
+        "open_figures": len(plt.get_fignums()),
+    }
+
+def run_threads(df: pd.DataFrame, charts: int, threads: int) -> Dict[str, float]:
+    expected = {chart: tools.draw_chart(df, *chart) for chart in CHARTS}
+    jobs = [CHARTS[i % len(CHARTS)] for i in range(charts)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        images = list(pool.map(lambda chart: tools.draw_chart(df, *chart), jobs))
+    elapsed = time.perf_counter() - start
+    mismatches = sum(image != expected[chart] for chart, image in zip(jobs, images))
+    return {"threads": threads, "charts_per_s": charts / elapsed, "mismatches": mismatches}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--charts", type=int, default=200, help="Charts rendered per implementation.")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows in the synthetic dataset.")
+    parser.add_argument("--threads", type=int, default=0, help="Also render with the engine from this many threads.")
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    print(f"matplotlib {matplotlib.__version__}, {args.charts} charts, {args.rows} rows")
+    print(f"{'implementation':<16} {'median ms':>10} {'total s':>8} {'RSS +MB':>8} {'failed':>7} {'open figs':>10}")
+    # The engine runs first so figures leaked by the baseline cannot inflate its numbers
+    for name, render in (("engine", tools.draw_chart), ("pyplot baseline", legacy_chart)):
+        result = run(name, render, df, args.charts)
+        print(
+            f"{result['name']:<16} {result['median_ms']:>10.1f} {result['total_s']:>8.2f} "
+            f"{result['rss_growth_mb']:>8.1f} {result['failures']:>7} {result['open_figures']:>10}"
+        )
+    if args.threads:
+        result = run_threads(df, args.charts, args.threads)
+        print(
+            f"engine x{result['threads']} threads: {result['charts_per_s']:.1f} charts/s, "
+            f"{result['mismatches']} images differ from single-threaded renders"
+        )
+
+if __name__ == "__main__":
+    main()
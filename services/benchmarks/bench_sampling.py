@@ -0,0 +1,78 @@
+"""
+Measures approximate charts (pandas-eda sampling.py) against exact ones.
+
+For each row count and seed, a sample is drawn for the target margin of error
+and the histogram bin shares and category shares it estimates are compared with
+the full column's. 'worst err' is the largest share error seen over all bins and
+seeds, which should stay within the reported margin at roughly the confidence
+level; 'covered' is the fraction of estimates inside the margin. --render also
+times a histogram render of the sample and of the full column.
+
+Run from the directory that contains the service packages (/app in the Docker image):
+
+    python -m benchmarks.bench_sampling --rows 1000000,10000000 --margin 0.01
+"""
+import argparse
+import importlib
+import time
+import numpy as np
+import pandas as pd
+
+sampling = importlib.import_module("pandas-eda.sampling")
+tools = importlib.import_module("pandas-eda.tools")
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "value": rng.lognormal(0, 1, rows),
+        "group": rng.choice(["a", "b", "c", "d", "rare"], rows, p=[0.4, 0.3, 0.2, 0.0999, 0.0001]),
+    })
+
+def shares(values: np.ndarray, edges: np.ndarray, weights=None) -> np.ndarray:
+    counts, _ = np.histogram(values, bins=edges, weights=weights)
+    return counts / counts.sum()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000000,10000000", help="Comma-separated row counts.")
+    parser.add_argument("--margin", type=float, default=0.01, help="Target margin of error.")
+    parser.add_argument("--seeds", type=int, default=20, help="Samples drawn per case.")
+    parser.add_argument("--render", action="store_true", help="Also time histogram renders.")
+    args = parser.parse_args()
+
+    header = f"{'rows':>9} {'method':<10} {'sample':>7} {'draw ms':>8} {'margin':>7} {'worst err':>9} {'covered':>8}"
+    if args.render:
+        header += f" {'render sample ms':>17} {'render full ms':>15}"
+    print(header)
+    for rows in (int(value) for value in args.rows.split(",")):
+        df = make_frame(rows)
+        edges = np.histogram_bin_edges(df["value"], bins=50)
+        exact_bins = shares(df["value"].to_numpy(), edges)
+        exact_groups = df["group"].value_counts(normalize=True)
+        for method, stratify_by in (("uniform", None), ("stratified", "group")):
+            errors, draw_s = [], []
+            for seed in range(args.seeds):
+                start = time.perf_counter()
+                sample = sampling.draw_sample(df, args.margin, method=method, stratify_by=stratify_by, seed=seed)
+                draw_s.append(time.perf_counter() - start)
+                weights = sample.weights
+                errors.append(np.abs(shares(sample.frame["value"].to_numpy(), edges, weights) - exact_bins))
+                groups = sampling.weighted_value_counts(sample.frame["group"], weights)
+                errors.append(np.abs((groups / groups.sum()).reindex(exact_groups.index, fill_value=0) - exact_groups).to_numpy())
+            errors = np.concatenate(errors)
+            margin = sample.report["margin_of_error"]
+            line = (
+                f"{rows:>9} {method:<10} {sample.report['sample_size']:>7} {min(draw_s) * 1e3:>8.1f}"
+                f" {margin:>7.4f} {errors.max():>9.4f} {np.mean(errors <= margin):>8.1%}"
+            )
+            if args.render:
+                start = time.perf_counter()
+                tools.generate_histogram(sample.frame, "value", sample.weights)
+                sample_ms = (time.perf_counter() - start) * 1e3
+                start = time.perf_counter()
+                tools.generate_histogram(df, "value")
+                line += f" {sample_ms:>17.0f} {(time.perf_counter() - start) * 1e3:>15.0f}"
+            print(line)
+
+if __name__ == "__main__":
+    main()
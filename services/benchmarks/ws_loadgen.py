@@ -0,0 +1,377 @@
+"""
+WebSocket load generator for the agent.
+
+Connects N simulated clients to /ws/{client_id}. Each client replays a weighted
+mix of actions against a synthetic dataset, sending the next request as soon as
+the previous response arrives (plus optional think time). The report covers
+throughput, p50/p95/p99 latency per action and error rates. 'busy' counts the
+503 responses sent by admission control; clients back off for the suggested
+retry_after before sending again.
+
+By default the dataset is registered once and requests refer to it by
+dataset_id; --inline sends the records with every request instead. Results of
+the EDA actions are cached by the agent, so repeat requests measure the cache
+unless --no-cache is given (with --launch) or the agent runs with
+RESULT_CACHE_TTL_SECONDS=0.
+
+Run from the directory that contains the service packages (/app in the Docker image):
+
+    # Against running services
+    python -m benchmarks.ws_loadgen --url ws://127.0.0.1:8000 --clients 20 --duration 60
+
+    # Launch agent, EDA and ML services locally for the run
+    python -m benchmarks.ws_loadgen --launch --no-cache --clients 10 --rows 20000 --cols 12
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+import msgpack
+import numpy as np
+import orjson
+import pandas as pd
+import websockets
+
+MSGPACK_SUBPROTOCOL = "canvaslytics.msgpack.v1"
+
+# Short names accepted by --mix, and the action each one sends
+ACTIONS = {
+    "summary": "get_dataset_summary",
+    "chart": "generate_chart",
+    "initial": "get_initial_visualizations",
+    "train": "train_model",
+}
+DEFAULT_MIX = "summary=4,chart=4,initial=1,train=1"
+
+def make_dataset(rows: int, cols: int, seed: int = 0) -> Tuple[List[Dict[str, Any]], List[str], List[str]]:
+    """
+    Builds synthetic records: about two thirds numeric columns, the rest
+    categorical, 5% missing values, plus a binary 'target' column that depends
+    on the first features. Returns (records, numeric columns, categorical columns).
+    """
+    rng = np.random.default_rng(seed)
+    cols = max(cols, 2)
+    numeric = [f"num_{i}" for i in range(max(1, (2 * cols) // 3))]
+    categorical = [f"cat_{i}" for i in range(cols - len(numeric))]
+    frame = pd.DataFrame({name: rng.normal(rng.uniform(-10, 10), rng.uniform(1, 5), rows).round(3) for name in numeric})
+    for i, name in enumerate(categorical):
+        frame[name] = rng.choice([f"level_{j}" for j in range(3 + 2 * i)], rows)
+    score = frame[numeric[0]] - frame[numeric[0]].mean() + rng.normal(0, 1, rows)
+    frame["target"] = (score > 0).astype(int)
+    for name in numeric[1:] + categorical:
+        frame.loc[rng.random(rows) < 0.05, name] = None
+    records = orjson.loads(frame.to_json(orient="records"))
+    return records, numeric, categorical
+
+def parse_mix(value: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"unknown action '{name}'; choose from {', '.join(ACTIONS)}")
+        mix.append((ACTIONS[name], float(weight or 1)))
+    return mix
+
+class Workload:
+    """Builds request payloads for each action against the synthetic dataset."""
+    def __init__(self, records, numeric: List[str], categorical: List[str], inline: bool, model: str,
+                 chart_format: str = "png"):
+        self.records = records
+        self.numeric = numeric
+        self.categorical = categorical
+        self.inline = inline
+        self.model = model
+        self.chart_format = chart_format
+        self.dataset_id: Optional[str] = None
+
+    def dataset_ref(self) -> Dict[str, Any]:
+        return {"data": self.records} if self.inline or self.dataset_id is None else {"dataset_id": self.dataset_id}
+
+    def payload(self, action: str, rng: random.Random) -> Dict[str, Any]:
+        if action == "generate_chart":
+            if self.categorical and rng.random() < 0.4:
+                chart = {"chart_type": "bar_chart", "params": {"column": rng.choice(self.categorical)}}
+            else:
+                chart = {"chart_type": "histogram", "params": {"column": rng.choice(self.numeric)}}
+            return {**self.dataset_ref(), **chart, "format": self.chart_format}
+        if action == "train_model":
+            return {
+                **self.dataset_ref(),
+                "features": self.numeric[:4] + self.categorical[:2],
+                "target": "target",
+                "model_name": self.model,
+                "task_type": "classification",
+            }
+        if action == "get_initial_visualizations":
+            return {**self.dataset_ref(), "format": self.chart_format}
+        return self.dataset_ref()
+
+class Results:
+    """Latencies and outcomes per action."""
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.outcomes: Dict[str, Dict[str, int]] = {}
+        self.errors: Dict[str, int] = {}
+        self.received_bytes = 0
+
+    def record(self, action: str, outcome: str, seconds: Optional[float] = None, message: str = ""):
+        counts = self.outcomes.setdefault(action, {"success": 0, "error": 0, "busy": 0, "timeout": 0})
+        counts[outcome] += 1
+        if outcome == "success":
+            self.latencies.setdefault(action, []).append(seconds)
+        elif message:
+            key = f"{action}: {message[:120]}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        actions = {}
+        for action, counts in sorted(self.outcomes.items()):
+            latencies = np.array(self.latencies.get(action, []), dtype=float) * 1000
+            total = sum(counts.values())
+            actions[action] = {
+                **counts,
+                "requests": total,
+                "throughput_rps": round(counts["success"] / elapsed, 2),
+                "error_rate": round((total - counts["success"]) / total, 4) if total else 0.0,
+                **{
+                    f"{name}_ms": round(float(np.percentile(latencies, q)), 1) if latencies.size else None
+                    for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+                },
+            }
+        total = sum(a["requests"] for a in actions.values())
+        succeeded = sum(a["success"] for a in actions.values())
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "requests": total,
+            "throughput_rps": round(succeeded / elapsed, 2) if elapsed else 0.0,
+            "error_rate": round((total - succeeded) / total, 4) if total else 0.0,
+            "received_mb": round(self.received_bytes / 1e6, 1),
+            "actions": actions,
+            "errors": dict(sorted(self.errors.items(), key=lambda item: -item[1])[:10]),
+        }
+
+class Client:
+    """One WebSocket connection sending requests one at a time."""
+    def __init__(self, url: str, client_id: str, binary: bool):
+        self.url = f"{url.rstrip('/')}/ws/{client_id}"
+        self.binary = binary
+        self.ws = None
+        self._ids = itertools.count()
+
+    async def connect(self):
+        subprotocols = [MSGPACK_SUBPROTOCOL] if self.binary else None
+        self.ws = await websockets.connect(self.url, max_size=None, subprotocols=subprotocols, open_timeout=30)
+
+    async def request(self, action: str, payload: Dict[str, Any], timeout: float) -> Tuple[Dict[str, Any], int]:
+        """Sends one request and waits for its final response; returns it with the bytes received."""
+        request_id = f"r{next(self._ids)}"
+        message = {"action": action, "payload": payload, "request_id": request_id}
+        await self.ws.send(msgpack.packb(message, use_bin_type=True) if self.binary else orjson.dumps(message).decode())
+        received = 0
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = await asyncio.wait_for(self.ws.recv(), max(0.0, deadline - time.monotonic()))
+            received += len(frame)
+            response = msgpack.unpackb(frame, raw=False) if isinstance(frame, bytes) else orjson.loads(frame)
+            # Streaming actions send intermediate messages before the final one
+            if response.get("request_id") == request_id and response.get("status") in ("success", "error"):
+                return response, received
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+async def run_client(
+    index: int, args, workload: Workload, mix, results: Results, start_at: float, stop_at: float, measure_from: float
+):
+    rng = random.Random(args.seed + index)
+    actions, weights = zip(*mix)
+    client = Client(args.url, f"loadgen-{index}", args.binary)
+    try:
+        await client.connect()
+    except Exception as e:
+        results.record("connect", "error", message=f"{type(e).__name__}: {e}")
+        return
+    try:
+        # Spread the first requests over the ramp-up period
+        await asyncio.sleep(max(0.0, start_at + rng.random() * args.ramp_up - time.monotonic()))
+        while time.monotonic() < stop_at:
+            action = rng.choices(actions, weights)[0]
+            sent_at = time.monotonic()
+            try:
+                response, received = await client.request(action, workload.payload(action, rng), args.timeout)
+            except asyncio.TimeoutError:
+                if sent_at >= measure_from:
+                    results.record(action, "timeout", message="no response within --timeout")
+                # The late response would be mistaken for the next one; start over on a new connection
+                await client.close()
+                await client.connect()
+                continue
+            latency = time.monotonic() - sent_at
+            measured = sent_at >= measure_from
+            if measured:
+                results.received_bytes += received
+            if response.get("status") == "success":
+                if measured:
+                    results.record(action, "success", latency)
+            elif response.get("statusCode") == 503 and "retry_after" in response:
+                if measured:
+                    results.record(action, "busy")
+                await asyncio.sleep(float(response["retry_after"]))
+                continue
+            elif measured:
+                results.record(action, "error", message=str(response.get("message")))
+            if args.think_ms:
+                await asyncio.sleep(rng.expovariate(1000 / args.think_ms))
+    except websockets.ConnectionClosed as e:
+        results.record("connect", "error", message=f"connection closed: {e}")
+    finally:
+        await client.close()
+
+async def register_dataset(args, workload: Workload):
+    client = Client(args.url, "loadgen-setup", args.binary)
+    await client.connect()
+    try:
+        started_at = time.monotonic()
+        response, _ = await client.request("register_dataset", {"data": workload.records}, args.timeout)
+        if response.get("status") != "success":
+            raise SystemExit(f"register_dataset failed: {response.get('message')}")
+        workload.dataset_id = response["dataset_id"]
+        print(f"registered dataset {workload.dataset_id} in {time.monotonic() - started_at:.2f}s", file=sys.stderr)
+    finally:
+        await client.close()
+
+async def run(args) -> Dict[str, Any]:
+    records, numeric, categorical = make_dataset(args.rows, args.cols, args.seed)
+    print(
+        f"dataset: {args.rows} rows, {len(numeric)} numeric + {len(categorical)} categorical columns, "
+        f"{len(orjson.dumps(records)) / 1e6:.1f} MB as JSON",
+        file=sys.stderr,
+    )
+    workload = Workload(records, numeric, categorical, args.inline, args.model, args.chart_format)
+    if not args.inline:
+        await register_dataset(args, workload)
+
+    results = Results()
+    start_at = time.monotonic()
+    measure_from = start_at + args.warmup
+    stop_at = measure_from + args.duration
+    await asyncio.gather(*(
+        run_client(i, args, workload, args.mix, results, start_at, stop_at, measure_from) for i in range(args.clients)
+    ))
+    # Requests still running at stop_at finish and are counted, so measure up to the last one
+    return results.report(max(time.monotonic(), stop_at) - measure_from)
+
+def print_report(report: Dict[str, Any]):
+    print(
+        f"\n{report['requests']} requests in {report['elapsed_seconds']}s: "
+        f"{report['throughput_rps']} successful req/s, error rate {report['error_rate']:.2%}, "
+        f"{report['received_mb']} MB received"
+    )
+    header = f"{'action':<28} {'ok':>6} {'busy':>5} {'err':>5} {'t/o':>5} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for action, a in report["actions"].items():
+        values = [a[f"{name}_ms"] for name in ("p50", "p95", "p99", "max")]
+        latencies = " ".join(f"{v:>8.1f}" if v is not None else f"{'-':>8}" for v in values)
+        print(
+            f"{action:<28} {a['success']:>6} {a['busy']:>5} {a['error']:>5} {a['timeout']:>5} "
+            f"{a['throughput_rps']:>7.2f} {latencies}"
+        )
+    if report["errors"]:
+        print("\nMost frequent errors:")
+        for message, count in report["errors"].items():
+            print(f"  {count:>5}  {message}")
+
+# --- Local services (--launch) ---
+
+def wait_until_up(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise SystemExit(f"{url} did not come up within {timeout:.0f}s")
+            time.sleep(0.5)
+
+def launch_services(args) -> List[subprocess.Popen]:
+    """Starts the EDA, ML and agent services with uvicorn from the current directory."""
+    base_port = args.base_port
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])),
+        "PANDAS_EDA_URL": f"http://127.0.0.1:{base_port + 1}",
+        "SKLEARN_LAB_URL": f"http://127.0.0.1:{base_port + 2}",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+    if args.no_cache:
+        env["RESULT_CACHE_TTL_SECONDS"] = "0"
+    services = [("pandas-eda.main:app", base_port + 1), ("sklearn-lab.main:app", base_port + 2), ("agent.main:app", base_port)]
+    processes = []
+    for module, port in services:
+        command = [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port)]
+        log_file = open(os.path.join(args.log_dir, f"loadgen-{module.split('.')[0]}.log"), "wb")
+        processes.append(subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT))
+    for _, port in services:
+        wait_until_up(f"http://127.0.0.1:{port}/", args.startup_timeout)
+    args.url = f"ws://127.0.0.1:{base_port}"
+    print(f"services up; logs in {args.log_dir}/loadgen-*.log", file=sys.stderr)
+    return processes
+
+def stop_services(processes: List[subprocess.Popen]):
+    for process in processes:
+        process.send_signal(signal.SIGINT)
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:8000", help="Agent base URL.")
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent WebSocket connections.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds.")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds of load before measuring.")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="Seconds over which clients send their first request.")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between a client's requests.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Action weights (default {DEFAULT_MIX}).")
+    parser.add_argument("--rows", type=int, default=5000, help="Rows in the synthetic dataset.")
+    parser.add_argument("--cols", type=int, default=8, help="Feature columns in the synthetic dataset.")
+    parser.add_argument("--inline", action="store_true", help="Send the records with every request instead of a dataset_id.")
+    parser.add_argument("--binary", action="store_true", help="Use the MessagePack subprotocol.")
+    parser.add_argument("--chart-format", choices=("png", "vega"), default="png",
+                        help="Chart output: rendered PNGs or Vega-Lite specs.")
+    parser.add_argument("--model", default="Logistic Regression", help="Model for train_model requests.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for each response.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="Also write the report as JSON.")
+    parser.add_argument("--launch", action="store_true", help="Start the three services locally for the run.")
+    parser.add_argument("--base-port", type=int, default=18000, help="With --launch: agent port; EDA and ML use the next two.")
+    parser.add_argument("--no-cache", action="store_true", help="With --launch: disable the agent's result cache.")
+    parser.add_argument("--log-dir", default=".", help="With --launch: where service logs are written.")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    processes = launch_services(args) if args.launch else []
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        stop_services(processes)
+    print_report(report)
+    if args.json:
+        with open(args.json, "wb") as f:
+            f.write(orjson.dumps({"config": vars(args), **report}, option=orjson.OPT_INDENT_2))
+
+if __name__ == "__main__":
+    main()
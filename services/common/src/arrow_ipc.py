@@ -0,0 +1,34 @@
+import pandas as pd
+import pyarrow as pa
+from typing import Any, Dict, List
+
+# Media type for the Arrow IPC streaming format
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+def dataframe_from_arrow_stream(body: bytes) -> pd.DataFrame:
+    """
+    Decodes an Arrow IPC stream into a DataFrame.
+
+    The reader works directly on the request buffer, and the table releases each
+    column as soon as pandas has taken it, so peak memory stays close to one copy.
+    """
+    if not body:
+        raise ValueError("Request body must contain an Arrow IPC stream.")
+    with pa.ipc.open_stream(pa.py_buffer(body)) as reader:
+        table = reader.read_all()
+    if table.num_rows == 0:
+        raise ValueError("Arrow stream contains no rows.")
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+def arrow_stream_from_records(records: List[Dict[str, Any]]) -> bytes:
+    """
+    Encodes a list of records as an Arrow IPC stream.
+
+    Raises:
+        pa.ArrowException: If a column mixes types Arrow cannot unify.
+    """
+    table = pa.Table.from_pylist(records)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,168 @@
+"""
+Building blocks shared by the services' caches: coalescing of concurrent
+identical work (SingleFlight) and a byte-bounded LRU of files (DiskLRU).
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from . import log
+
+logger = log.get_logger("caching")
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: callers with the same key await one
+    shared call and all receive its result or its exception.
+
+    The shared call is cancelled only when every caller waiting on it has
+    been cancelled; a single caller going away does not affect the others.
+    Results are shared between callers and must be treated as read-only.
+    """
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Task"] = {}
+        self._waiters: Dict[str, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def __contains__(self, key: str) -> bool:
+        """Whether a call for key is in flight, i.e. do(key, ...) would join it."""
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and not task.done():
+                    # Nobody is left to receive the result; later callers start a fresh call
+                    self._forget(key, task)
+                    task.cancel()
+
+    def _forget(self, key: str, task: "asyncio.Task"):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+class DiskLRU:
+    """
+    Blobs stored as one file per key in a directory, bounded by bytes with the
+    least-recently-used files removed first. Files are written under a temporary
+    name and renamed, so readers never see a partial one, and files left by a
+    previous run (or written by other processes sharing the directory) are
+    picked up. Only files ending in `suffix` are ever read, indexed or removed.
+
+    Methods do blocking file I/O; call them from worker threads. They are thread-safe.
+    """
+    def __init__(self, directory: str, max_bytes: int, suffix: str):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def read(self, key: str, max_age: Optional[float] = None) -> Optional[bytes]:
+        """Returns the blob stored under key, or None; files older than max_age seconds are removed instead."""
+        path = self.path(key)
+        try:
+            if max_age is not None and os.path.getmtime(path) + max_age < time.time():
+                self.discard(key)
+                return None
+            with open(path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+            return None
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:
+                self._index[key] = len(blob)
+                self._bytes += len(blob)
+        return blob
+
+    def write(self, key: str, blob: bytes):
+        """Stores blob under key, then removes the oldest files while over budget. Failures are logged, not raised."""
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write cache file", extra={"path": path, "error": str(e)})
+            return
+        with self._lock:
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = len(blob)
+            self._bytes += len(blob)
+            victims = []
+            # The newest file always stays, even if it alone exceeds the budget
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                victim, size = self._index.popitem(last=False)
+                self._bytes -= size
+                victims.append(victim)
+        for victim in victims:
+            self._unlink(victim)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._bytes -= self._index.pop(key, 0)
+        self._unlink(key)
+
+    def _unlink(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def _load_index(self):
+        """Indexes files left by a previous run, oldest first."""
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
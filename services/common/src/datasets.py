@@ -0,0 +1,364 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import pandas as pd
+from collections import OrderedDict
+from pyarrow import feather
+from typing import Any, Dict, List, Optional, Tuple
+from . import fast_json, log
+
+# Byte budget for DataFrames kept in memory; least-recently-used ones beyond it are spilled to disk
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Each service spills into its own subdirectory of this one (see use_spill_dir)
+DATASET_SPILL_DIR = os.getenv("DATASET_SPILL_DIR", os.path.join(tempfile.gettempdir(), "canvaslytics-datasets"))
+DATASET_SPILL_MAX_BYTES = int(os.getenv("DATASET_SPILL_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+
+logger = log.get_logger("datasets")
+
+# Names of the files a store writes: the dataset_id (a fingerprint) and the format's extension
+_SPILL_FILE = re.compile(r"^[0-9a-f]{32}\.(arrow|pkl)$")
+
+class DatasetNotFoundError(KeyError):
+    """Raised when a dataset_id is not registered with this service (e.g. after a restart)."""
+    def __init__(self, dataset_id: str):
+        self.dataset_id = dataset_id
+        super().__init__(dataset_id)
+
+    def __str__(self):
+        return f"Dataset '{self.dataset_id}' is not registered. Upload it again via /datasets."
+
+def fingerprint(df: pd.DataFrame) -> str:
+    """
+    Returns a content hash of a DataFrame.
+
+    The same records always produce the same id, so every service that registers
+    a dataset agrees on its dataset_id without coordinating.
+    """
+    hasher = hashlib.sha256()
+    hasher.update("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    hasher.update("\x1f".join(map(str, df.dtypes)).encode("utf-8"))
+    try:
+        row_hashes = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:
+        # Nested values (lists/dicts in cells) are not hashable; fall back to their text form
+        row_hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+    hasher.update(row_hashes.values.tobytes())
+    return hasher.hexdigest()[:32]
+
+class DatasetStore:
+    """
+    Keeps registered DataFrames in memory, keyed by their content fingerprint.
+
+    Resident frames are bounded by a global byte budget measured with
+    memory_usage(deep=True). When a new frame pushes the total over budget,
+    the least-recently-used frames are spilled to Arrow/Feather files in
+    spill_dir and reloaded on their next use instead of being dropped. The store
+    owns spill_dir: it adopts the spill files it finds there on startup and
+    deletes them when trimming, so no two stores may share one. A store created
+    without a spill_dir spills to a temporary directory of its own.
+
+    Stored frames are shared between requests and must be treated as read-only.
+    """
+    def __init__(self, max_bytes: int = DATASET_CACHE_MAX_BYTES, spill_dir: Optional[str] = None,
+                 max_spill_bytes: int = DATASET_SPILL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self._frames: "OrderedDict[str, Tuple[pd.DataFrame, int]]" = OrderedDict()
+        self._spilling: Dict[str, pd.DataFrame] = {}
+        self._spilled: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        # Spill files other processes still have to read (e.g. queued training jobs): dataset_id -> refcount
+        self._pins: Dict[str, int] = {}
+        self._bytes = 0
+        self._spill_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spill_errors = 0
+        if spill_dir is not None:
+            self._load_spill_index()
+
+    def set_spill_dir(self, spill_dir: str):
+        """Gives a store created without a spill_dir its directory and adopts the spill files in it."""
+        with self._lock:
+            if self.spill_dir is not None:
+                raise RuntimeError(f"The dataset store already spills to {self.spill_dir}.")
+            self.spill_dir = spill_dir
+        self._load_spill_index()
+
+    def _spill_root(self) -> str:
+        """Returns spill_dir, creating a temporary one if the store was never given one. Must hold the lock."""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="canvaslytics-datasets-")
+        return self.spill_dir
+
+    def put(self, df: pd.DataFrame) -> str:
+        """Registers a DataFrame and returns its dataset_id."""
+        dataset_id = fingerprint(df)
+        with self._lock:
+            if dataset_id in self._frames:
+                self._frames.move_to_end(dataset_id)
+                return dataset_id
+            victims = self._insert(dataset_id, df)
+        self._spill(victims)
+        return dataset_id
+
+    def get(self, dataset_id: str) -> pd.DataFrame:
+        """Returns a registered DataFrame, reloading it from disk if it was spilled, or raises DatasetNotFoundError."""
+        with self._lock:
+            entry = self._frames.get(dataset_id)
+            if entry is not None:
+                self._frames.move_to_end(dataset_id)
+                self.hits += 1
+                return entry[0]
+            if dataset_id in self._spilling:
+                self.hits += 1
+                return self._spilling[dataset_id]
+            spilled = self._spilled.get(dataset_id)
+            if spilled is None:
+                self.misses += 1
+                raise DatasetNotFoundError(dataset_id)
+
+        try:
+            df = read_dataset_file(spilled[0])
+        except OSError:
+            # Trimmed from the spill directory since the lookup above
+            with self._lock:
+                if self._spilled.get(dataset_id) == spilled:
+                    del self._spilled[dataset_id]
+                    self._spill_bytes -= spilled[1]
+                self.misses += 1
+            raise DatasetNotFoundError(dataset_id)
+        with self._lock:
+            self.disk_hits += 1
+            victims = []
+            if dataset_id not in self._frames:
+                victims = self._insert(dataset_id, df)
+        self._spill(victims)
+        return df
+
+    def peek(self, dataset_id: str) -> Optional[pd.DataFrame]:
+        """Returns the frame if it is resident in memory, without touching LRU order or counters."""
+        with self._lock:
+            entry = self._frames.get(dataset_id)
+            return entry[0] if entry is not None else self._spilling.get(dataset_id)
+
+    def shared_path(self, dataset_id: str, pin: bool = False) -> str:
+        """
+        Returns a file that other processes (e.g. render workers) can load the dataset from.
+
+        The dataset's spill file is reused when it exists; otherwise one is written
+        now, which also makes a later eviction of this dataset free. With pin=True
+        the file is pinned before it is returned, so trimming the spill directory
+        cannot delete it until the caller calls unpin.
+        """
+        with self._lock:
+            spilled = self._spilled.get(dataset_id)
+            if spilled is not None and os.path.exists(spilled[0]):
+                if pin:
+                    self._pins[dataset_id] = self._pins.get(dataset_id, 0) + 1
+                return spilled[0]
+
+        df = self.get(dataset_id)
+        with self._lock:
+            spill_dir = self._spill_root()
+        os.makedirs(spill_dir, exist_ok=True)
+        path = _write_spill_file(df, os.path.join(spill_dir, dataset_id))
+        size = os.path.getsize(path)
+        with self._lock:
+            if pin:
+                self._pins[dataset_id] = self._pins.get(dataset_id, 0) + 1
+            if dataset_id not in self._spilled:
+                self._spilled[dataset_id] = (path, size)
+                self._spill_bytes += size
+                self._trim_spill_dir()
+        return path
+
+    def unpin(self, dataset_id: str):
+        """Releases a pin taken by shared_path(pin=True); unpinned files can be trimmed again."""
+        with self._lock:
+            count = self._pins.get(dataset_id, 0) - 1
+            if count > 0:
+                self._pins[dataset_id] = count
+                return
+            self._pins.pop(dataset_id, None)
+            self._trim_spill_dir()
+
+    def __contains__(self, dataset_id: str) -> bool:
+        with self._lock:
+            return dataset_id in self._frames or dataset_id in self._spilling or dataset_id in self._spilled
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns occupancy and hit/miss/eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "resident_datasets": len(self._frames),
+                "resident_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "spilled_datasets": len(self._spilled),
+                "spilled_bytes": self._spill_bytes,
+                "pinned_datasets": len(self._pins),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "spill_errors": self.spill_errors,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else None,
+            }
+
+    def _insert(self, dataset_id: str, df: pd.DataFrame) -> List[Tuple[str, pd.DataFrame]]:
+        """Adds a frame and pops LRU frames until back under budget. Must hold the lock."""
+        size = int(df.memory_usage(deep=True, index=True).sum())
+        self._frames[dataset_id] = (df, size)
+        self._bytes += size
+        victims = []
+        # The newest frame always stays resident, even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._frames) > 1:
+            victim_id, (victim_df, victim_size) = self._frames.popitem(last=False)
+            self._bytes -= victim_size
+            self.evictions += 1
+            if victim_id not in self._spilled:
+                self._spilling[victim_id] = victim_df
+                victims.append((victim_id, victim_df))
+        return victims
+
+    def _spill(self, victims: List[Tuple[str, pd.DataFrame]]):
+        """Writes evicted frames to disk outside the lock; they stay readable from memory meanwhile."""
+        if victims:
+            with self._lock:
+                spill_dir = self._spill_root()
+        for dataset_id, df in victims:
+            try:
+                os.makedirs(spill_dir, exist_ok=True)
+                path = _write_spill_file(df, os.path.join(spill_dir, dataset_id))
+                size = os.path.getsize(path)
+            except Exception as e:
+                logger.warning("Could not spill dataset to disk, dropping it", extra={"dataset_id": dataset_id, "error": str(e)})
+                with self._lock:
+                    self._spilling.pop(dataset_id, None)
+                    self.spill_errors += 1
+                continue
+            with self._lock:
+                self._spilling.pop(dataset_id, None)
+                self._spilled[dataset_id] = (path, size)
+                self._spill_bytes += size
+                self._trim_spill_dir()
+
+    def _trim_spill_dir(self):
+        """Deletes the oldest unpinned spill files once the on-disk budget is exceeded. Must hold the lock."""
+        for dataset_id in list(self._spilled):
+            if self._spill_bytes <= self.max_spill_bytes or len(self._spilled) <= 1:
+                break
+            if dataset_id in self._pins:
+                continue
+            path, size = self._spilled.pop(dataset_id)
+            self._spill_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _load_spill_index(self):
+        """Re-adopts spill files left by a previous run so those datasets survive a restart."""
+        if not os.path.isdir(self.spill_dir):
+            return
+        entries = []
+        for name in os.listdir(self.spill_dir):
+            # Anything else in the directory (temporary files, files put there by hand) is left alone
+            if not _SPILL_FILE.match(name):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        with self._lock:
+            for _, dataset_id, path, size in sorted(entries):
+                if dataset_id not in self._spilled:
+                    self._spilled[dataset_id] = (path, size)
+                    self._spill_bytes += size
+
+def _write_spill_file(df: pd.DataFrame, base_path: str) -> str:
+    """
+    Writes a frame as an Arrow/Feather file, falling back to pickle for columns Arrow cannot type.
+    Files are written under a temporary name and renamed, so readers never see a partial file.
+    """
+    tmp_path = f"{base_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        try:
+            df.reset_index(drop=True).to_feather(tmp_path)
+            path = base_path + ".arrow"
+        except Exception as e:
+            logger.warning("Feather spill failed; using pickle instead", extra={"error": str(e)})
+            df.to_pickle(tmp_path)
+            path = base_path + ".pkl"
+        os.replace(tmp_path, path)
+        return path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def read_dataset_file(path: str) -> pd.DataFrame:
+    """
+    Reads a frame written by _write_spill_file. Arrow files are memory-mapped, so
+    several processes reading the same dataset share its pages through the OS cache.
+    """
+    if path.endswith(".arrow"):
+        return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+    return pd.read_pickle(path)
+
+# Process-wide store shared by all request handlers; each service names its spill directory with use_spill_dir
+store = DatasetStore()
+
+def use_spill_dir(service: str):
+    """
+    Makes the process-wide store spill to DATASET_SPILL_DIR/<service>, so services
+    started on one host never adopt or trim each other's files. Called when a
+    service is loaded; the first call in a process wins, so in monolith mode the
+    agent names the directory before loading the services.
+    """
+    if store.spill_dir is None:
+        store.set_spill_dir(os.path.join(DATASET_SPILL_DIR, service))
+
+def register(df: pd.DataFrame) -> Dict[str, Any]:
+    """Stores a DataFrame in the process-wide store and returns the /datasets response body."""
+    dataset_id = store.put(df)
+    return {
+        "status": "success",
+        "dataset_id": dataset_id,
+        "rows": len(df),
+        "columns": len(df.columns),
+    }
+
+def share(df: pd.DataFrame, dataset_id: Optional[str] = None, pin: bool = False) -> Tuple[str, str]:
+    """
+    Registers df if needed and returns a (dataset_id, path) reference that worker
+    processes can load it from with read_dataset_file. With pin=True the file is
+    kept until store.unpin(dataset_id), for readers that may start much later.
+    """
+    if dataset_id is None:
+        dataset_id = store.put(df)
+    return dataset_id, store.shared_path(dataset_id, pin=pin)
+
+def records_to_dataframe(data: Any) -> pd.DataFrame:
+    """Builds a DataFrame from a list of records, like what pandas df.to_dict('records') produces."""
+    if not data or not isinstance(data, list):
+        raise ValueError("Payload must contain a 'data' key with a list of records.")
+    return fast_json.dataframe_from_records(data)
+
+def resolve_dataframe(data: Optional[List[Dict[str, Any]]], dataset_id: Optional[str]) -> pd.DataFrame:
+    """
+    Returns the DataFrame a request refers to: inline 'data' records take precedence,
+    otherwise the registered 'dataset_id' is looked up.
+    """
+    if data is None and dataset_id:
+        return store.get(dataset_id)
+    if data is None:
+        raise ValueError("Payload must contain either 'data' records or a 'dataset_id'.")
+    return records_to_dataframe(data)
@@ -0,0 +1,165 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+from . import metrics, tracing
+
+# Threads serve NumPy/pandas work that releases the GIL; processes serve matplotlib rendering
+# and model fitting, which hold the GIL (and pyplot is not thread-safe).
+THREAD_POOL_WORKERS = int(os.getenv("THREAD_POOL_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+# 0 disables the process pool; CPU-bound work then runs on a single dedicated thread
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", str(os.cpu_count() or 1)))
+# 'spawn' avoids forking a process that already runs an event loop and worker threads
+PROCESS_START_METHOD = os.getenv("PROCESS_START_METHOD", "spawn")
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict) -> Tuple[Any, float, float, list]:
+    """
+    Runs fn inside the worker and reports wall-clock start and end times for queue
+    metrics, plus the trace spans opened while it ran.
+    """
+    with tracing.collect() as spans:
+        started_at = time.time()
+        result = fn(*args, **kwargs)
+        finished_at = time.time()
+    return result, started_at, finished_at, spans
+
+class TaskStats:
+    """Wait and run time totals for one task name in one pool."""
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        count = self.completed or 1
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(1000 * self.wait_seconds / count, 3),
+            "max_wait_ms": round(1000 * self.max_wait_seconds, 3),
+            "avg_run_ms": round(1000 * self.run_seconds / count, 3),
+            "max_run_ms": round(1000 * self.max_run_seconds, 3),
+        }
+
+class WorkerPool:
+    """
+    A lazily created executor with queue-depth and wait-time accounting.
+
+    Wait time is measured from submission until the worker starts the task,
+    so it captures queueing behind other work in the pool.
+    """
+    def __init__(self, name: str, workers: int, factory: Callable[[], Executor]):
+        self.name = name
+        self.workers = workers
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.max_pending = 0
+        self.tasks: Dict[str, TaskStats] = {}
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._factory()
+            return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Runs fn(*args, **kwargs) in the pool and returns its result."""
+        name = getattr(fn, "__name__", repr(fn))
+        stats = self.tasks.setdefault(name, TaskStats())
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        submitted_at = time.time()
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        try:
+            result, started_at, finished_at, spans = await loop.run_in_executor(
+                executor, functools.partial(_timed_call, fn, args, kwargs)
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for the next task
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            stats.failed += 1
+            raise
+        except BaseException:
+            stats.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+
+        wait, run = max(0.0, started_at - submitted_at), finished_at - started_at
+        stats.completed += 1
+        stats.wait_seconds += wait
+        stats.max_wait_seconds = max(stats.max_wait_seconds, wait)
+        stats.run_seconds += run
+        stats.max_run_seconds = max(stats.max_run_seconds, run)
+        metrics.WORKER_TASK_SECONDS.labels(self.name, name, "wait").observe(wait)
+        metrics.WORKER_TASK_SECONDS.labels(self.name, name, "run").observe(run)
+        tracing.record_task(name, started_at, finished_at, spans, pool=self.name, wait_ms=round(1000 * wait, 3))
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "queue_depth": max(0, self.pending - self.workers),
+            "max_pending": self.max_pending,
+            "tasks": {name: task.to_dict() for name, task in self.tasks.items()},
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def _create_process_executor() -> Executor:
+    if PROCESS_POOL_WORKERS <= 0:
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="cpu-serial")
+    return ProcessPoolExecutor(
+        max_workers=PROCESS_POOL_WORKERS,
+        mp_context=multiprocessing.get_context(PROCESS_START_METHOD),
+    )
+
+thread_pool = WorkerPool(
+    "thread",
+    THREAD_POOL_WORKERS,
+    lambda: ThreadPoolExecutor(max_workers=THREAD_POOL_WORKERS, thread_name_prefix="numpy"),
+)
+process_pool = WorkerPool("process", max(1, PROCESS_POOL_WORKERS), _create_process_executor)
+
+async def run_in_thread(fn: Callable, *args, **kwargs) -> Any:
+    """Runs GIL-releasing NumPy/pandas work off the event loop."""
+    return await thread_pool.run(fn, *args, **kwargs)
+
+async def run_in_process(fn: Callable, *args, **kwargs) -> Any:
+    """Runs GIL-bound work (rendering, model fitting) in a worker process. fn and its arguments must be picklable."""
+    return await process_pool.run(fn, *args, **kwargs)
+
+async def warm_up_processes(fn: Callable):
+    """
+    Submits fn once per worker slot so the pool starts its processes and pays
+    imports and first-use costs at startup instead of on the first requests.
+    """
+    await asyncio.gather(*(process_pool.run(fn) for _ in range(process_pool.workers)), return_exceptions=True)
+
+def stats() -> Dict[str, Any]:
+    """Returns queue and timing metrics for both pools."""
+    return {"thread_pool": thread_pool.stats(), "process_pool": process_pool.stats()}
+
+def shutdown():
+    """Stops both pools. Called at app shutdown."""
+    thread_pool.shutdown()
+    process_pool.shutdown()
@@ -0,0 +1,172 @@
+"""
+Non-blocking structured logging shared by the services.
+
+Records are handed to a bounded in-memory queue and written to stdout by a
+background thread, so logging never blocks the event loop on I/O; when the
+queue is full, records are dropped and counted rather than waited for.
+Each record carries the current request id, and per-request records can be
+sampled. Log payload shapes with summarize(), never the payloads themselves.
+"""
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import orjson
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# 'json' (one object per line) or 'text'
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Fraction of requests whose INFO/DEBUG records are kept; warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Records buffered for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Header used to carry the request id from the agent to the services
+REQUEST_ID_HEADER = "x-request-id"
+
+# Id of the request being handled by the current task; set per WebSocket message or HTTP request
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+class _RequestContextFilter(logging.Filter):
+    """Stamps records with the request id and drops unsampled per-request records."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if record.levelno >= logging.WARNING or LOG_SAMPLE_RATE >= 1.0:
+            return True
+        if record.request_id is None:
+            return random.random() < LOG_SAMPLE_RATE
+        # Hash the id so that a request's records are kept or dropped together
+        return zlib.crc32(record.request_id.encode()) % 10_000 < LOG_SAMPLE_RATE * 10_000
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records instead of blocking or erroring when the queue is full."""
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object, including fields passed via `extra=`."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None) is not None:
+            entry["request_id"] = record.request_id
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+class TextFormatter(logging.Formatter):
+    """Human-readable format for local development; extra fields are appended as key=value."""
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = time.strftime("%H:%M:%S", time.localtime(record.created))
+        request_id = getattr(record, "request_id", None)
+        line = f"{timestamp} {record.levelname:<7} {record.name}"
+        if request_id is not None:
+            line += f" [{request_id}]"
+        line += f" {record.getMessage()}"
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={orjson.dumps(value, default=str).decode()}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def _extra_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+_setup_lock = threading.Lock()
+_handler: Optional[_DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup():
+    """Installs the queue handler and starts the writer thread. Safe to call more than once."""
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is not None:
+            return
+        log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        _listener = logging.handlers.QueueListener(log_queue, output)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        _handler = _DroppingQueueHandler(log_queue)
+        _handler.addFilter(_RequestContextFilter())
+        root = logging.getLogger("canvaslytics")
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(_handler)
+        root.propagate = False
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns a logger under the shared 'canvaslytics' hierarchy, setting logging up on first use."""
+    setup()
+    return logging.getLogger(f"canvaslytics.{name}")
+
+def dropped_records() -> int:
+    """How many records were discarded because the queue was full."""
+    return _handler.dropped if _handler is not None else 0
+
+def summarize(value: Any, depth: int = 0) -> Any:
+    """
+    Describes the shape of a payload without its contents: lists are reduced to
+    their length and the shape of their first item, long strings and bytes to
+    their length. Cost does not grow with the number of records.
+    """
+    if isinstance(value, dict):
+        if depth >= 2:
+            return f"dict[{len(value)}]"
+        items = list(value.items())[:20]
+        return {str(key): summarize(item, depth + 1) for key, item in items}
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return "list[0]"
+        first = value[0]
+        return f"list[{len(value)}] of {summarize(first, 2) if isinstance(first, (dict, list, tuple)) else type(first).__name__}"
+    if isinstance(value, (str, bytes, bytearray)):
+        if len(value) <= 64:
+            return value if isinstance(value, str) else f"bytes[{len(value)}]"
+        return f"{type(value).__name__}[{len(value)}]"
+    return value
+
+class RequestIdMiddleware:
+    """ASGI middleware that adopts the caller's X-Request-ID for the duration of each HTTP request."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")
+                break
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,307 @@
+"""
+Minimal Prometheus instrumentation shared by the services.
+
+Counters, gauges and histograms are kept in process memory and rendered in
+the Prometheus text exposition format by the /metrics endpoint. Updates are
+a dict lookup, a bisect and a lock, so instrumentation can stay on in
+production. Label values must come from small fixed sets (route templates,
+action names), never from user input.
+"""
+import abc
+import asyncio
+import bisect
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# How often the event-loop lag monitor wakes up
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = tuple(float(4 ** exponent) * 256 for exponent in range(10))  # 256 B .. 64 MB
+COUNT_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str, **kwargs: str):
+        """Returns the child series for the given label values, creating it on first use."""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Creates the value of one label combination."""
+
+    def _default(self):
+        return self.labels()
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return lines
+
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self, name: str, labelnames, values) -> List[str]:
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+class Gauge(_Metric):
+    """A value that goes up and down. With `function`, it is read at scrape time instead."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def collect(self) -> List[str]:
+        if self.function is not None:
+            try:
+                self._default().set(self.function())
+            except Exception:
+                pass
+        return super().collect()
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name: str, labelnames, values) -> List[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(list(self.buckets) + [math.inf], self.counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        labels = _format_labels(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, plus their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+class Registry:
+    """The metrics of one process."""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Adds a metric, or returns the one already registered under its name (e.g. when a
+        module is imported twice).
+
+        Raises:
+            ValueError: If that name is taken by a metric of another type or with other labels.
+        """
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(
+                        f"Metric '{metric.name}' is already registered as a {existing.kind} "
+                        f"with labels {existing.labelnames}."
+                    )
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = (), function: Optional[Callable[[], float]] = None) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames, function))
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+def render() -> str:
+    """Returns every metric in the Prometheus text exposition format."""
+    return registry.render()
+
+# --- Metrics shared by all services ---
+
+HTTP_REQUEST_SECONDS = histogram(
+    "canvaslytics_http_request_duration_seconds",
+    "HTTP request latency by route template, method and status code.",
+    ("route", "method", "status"),
+)
+HTTP_REQUEST_BYTES = histogram(
+    "canvaslytics_http_request_size_bytes", "HTTP request body size by route.", ("route",), BYTES_BUCKETS
+)
+HTTP_RESPONSE_BYTES = histogram(
+    "canvaslytics_http_response_size_bytes", "HTTP response body size by route.", ("route",), BYTES_BUCKETS
+)
+HTTP_IN_FLIGHT = gauge("canvaslytics_http_requests_in_flight", "HTTP requests currently being served.")
+EVENT_LOOP_LAG_SECONDS = histogram(
+    "canvaslytics_event_loop_lag_seconds",
+    "How late the event loop ran a timer that was due; high values mean the loop is blocked.",
+    buckets=LAG_BUCKETS,
+)
+DATASET_ROWS = histogram(
+    "canvaslytics_dataset_rows", "Rows in the DataFrames processed, by operation.", ("operation",), COUNT_BUCKETS
+)
+DATASET_COLUMNS = histogram(
+    "canvaslytics_dataset_columns",
+    "Columns in the DataFrames processed, by operation.",
+    ("operation",),
+    (1, 2, 5, 10, 20, 50, 100, 500, 1000),
+)
+ROWS_PROCESSED = counter("canvaslytics_rows_processed_total", "Rows processed, by operation.", ("operation",))
+WORKER_TASK_SECONDS = histogram(
+    "canvaslytics_worker_task_seconds",
+    "Time worker-pool tasks spent queued (phase=wait) and running (phase=run), e.g. task=render_chart.",
+    ("pool", "task", "phase"),
+)
+
+def record_dataframe(operation: str, df) -> None:
+    """Records the shape of a DataFrame an operation worked on."""
+    rows, columns = df.shape
+    DATASET_ROWS.labels(operation).observe(rows)
+    DATASET_COLUMNS.labels(operation).observe(columns)
+    ROWS_PROCESSED.labels(operation).inc(rows)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, body sizes and in-flight count for every
+    HTTP request. Routes are labelled by their template (e.g. '/jobs/{job_id}'),
+    so the label set stays small.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        status = 500
+        response_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(route, scope["method"], str(status)).observe(time.perf_counter() - started_at)
+            HTTP_RESPONSE_BYTES.labels(route).observe(response_bytes)
+            for name, value in scope.get("headers", ()):
+                if name == b"content-length":
+                    HTTP_REQUEST_BYTES.labels(route).observe(int(value))
+                    break
+
+async def monitor_event_loop(interval: float = LOOP_LAG_INTERVAL_SECONDS):
+    """Samples event-loop lag until cancelled; run it as a background task from the app lifespan."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
@@ -0,0 +1,280 @@
+"""
+Lightweight distributed tracing shared by the services.
+
+A trace starts per WebSocket message in the agent and follows the request to
+the EDA/ML services through the W3C `traceparent` header. Spans are kept in
+an in-memory ring buffer, queryable through /debug/traces, and optionally
+appended to a JSON-lines file (TRACE_EXPORT_FILE) by a background thread.
+
+Work run in a worker pool has no trace context of its own: spans opened there
+are collected and returned with the result, and the calling process records
+them under a span for the task (see executor._timed_call).
+"""
+import contextvars
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Finished spans kept in memory for /debug/traces
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "5000"))
+# Optional JSON-lines file every finished span is appended to
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# Paths that are not worth tracing
+UNTRACED_PATHS = ("/metrics", "/stats", "/debug/traces", "/")
+
+_service_name = "unknown"
+
+def set_service(name: str):
+    """Names the service recorded on every span from this process."""
+    global _service_name
+    _service_name = name
+
+class Span:
+    """One timed operation. Attributes are plain JSON-compatible values."""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "attributes", "status")
+
+    def __init__(self, trace_id: Optional[str], parent_id: Optional[str], name: str, attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.status = "ok"
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": _service_name,
+            "start": self.start,
+            "duration_ms": round(1000 * ((self.end or time.time()) - self.start), 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off or there is no trace to attach to."""
+    traceparent = None
+
+    def set(self, **attributes: Any):
+        pass
+
+_NOOP = _NoopSpan()
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+# Set inside worker-pool tasks: spans opened there are gathered here and returned to the caller
+_collector: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("span_collector", default=None)
+
+class SpanExporter:
+    """Keeps finished spans in a ring buffer and, if configured, appends them to a JSONL file."""
+    def __init__(self, buffer_size: int = TRACE_BUFFER_SIZE, export_file: str = TRACE_EXPORT_FILE):
+        self._spans: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self.export_file = export_file
+        self._queue: Optional[queue.Queue] = None
+        self.dropped = 0
+
+    def export(self, span: Dict[str, Any]):
+        with self._lock:
+            self._spans.append(span)
+        if self.export_file:
+            if self._queue is None:
+                self._start_writer()
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                self.dropped += 1
+
+    def _start_writer(self):
+        with self._lock:
+            if self._queue is not None:
+                return
+            self._queue = queue.Queue(maxsize=10_000)
+            threading.Thread(target=self._write_loop, name="trace-writer", daemon=True).start()
+
+    def _write_loop(self):
+        while True:
+            spans = [self._queue.get()]
+            while not self._queue.empty() and len(spans) < 1000:
+                spans.append(self._queue.get_nowait())
+            try:
+                with open(self.export_file, "ab") as f:
+                    f.write(b"".join(orjson.dumps(span) + b"\n" for span in spans))
+            except OSError:
+                self.dropped += len(spans)
+
+    def traces(self, trace_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Groups buffered spans by trace, most recent traces first."""
+        with self._lock:
+            spans = list(self._spans)
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for span in spans:
+            if trace_id is None or span["trace_id"] == trace_id:
+                grouped.setdefault(span["trace_id"], []).append(span)
+        result = []
+        for tid, members in grouped.items():
+            members.sort(key=lambda span: span["start"])
+            ids = {span["span_id"] for span in members}
+            roots = [span for span in members if span["parent_id"] not in ids]
+            start = members[0]["start"]
+            end = max(span["start"] + span["duration_ms"] / 1000 for span in members)
+            result.append({
+                "trace_id": tid,
+                "root": roots[0]["name"] if roots else None,
+                "start": start,
+                "duration_ms": round(1000 * (end - start), 3),
+                "spans": members,
+            })
+        result.sort(key=lambda trace: trace["start"], reverse=True)
+        return result[:limit]
+
+exporter = SpanExporter()
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Returns (trace_id, parent span id) from a traceparent header, or None if absent or malformed."""
+    if not value:
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    return (match.group(1), match.group(2)) if match else None
+
+def inject(headers: Dict[str, str]) -> Dict[str, str]:
+    """Adds the current span's traceparent to outgoing request headers."""
+    span = _current.get()
+    if span is not None and span.trace_id is not None:
+        headers[TRACEPARENT_HEADER] = span.traceparent
+    return headers
+
+@contextmanager
+def span(name: str, parent: Optional[Tuple[str, str]] = None, new_trace: bool = False, **attributes: Any) -> Iterator[Any]:
+    """
+    Times a block as a child of the current span. `parent` continues a remote
+    trace and `new_trace` starts a fresh one. Outside any trace the block is
+    not recorded, except inside worker-pool tasks, where spans are collected
+    for the caller.
+    """
+    if not TRACING_ENABLED:
+        yield _NOOP
+        return
+    current_span = _current.get()
+    if new_trace:
+        trace_id, parent_id = new_trace_id(), None
+    elif parent is not None:
+        trace_id, parent_id = parent
+    elif current_span is not None:
+        trace_id, parent_id = current_span.trace_id, current_span.span_id
+    elif _collector.get() is not None:
+        trace_id, parent_id = None, None
+    else:
+        yield _NOOP
+        return
+
+    s = Span(trace_id, parent_id, name, attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.status = "error"
+        s.attributes["error"] = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        s.end = time.time()
+        _current.reset(token)
+        _finish(s)
+
+def _finish(s: Span):
+    if s.trace_id is None:
+        collector = _collector.get()
+        if collector is not None:
+            collector.append(s.to_dict())
+        return
+    exporter.export(s.to_dict())
+
+@contextmanager
+def collect() -> Iterator[List[Dict[str, Any]]]:
+    """Gathers the spans opened in a worker-pool task so they can be returned to the caller."""
+    spans: List[Dict[str, Any]] = []
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+def record_task(name: str, started_at: float, finished_at: float, collected: List[Dict[str, Any]], **attributes: Any):
+    """
+    Records a finished worker-pool task as a child of the current span, with the
+    spans collected inside the worker re-parented under it.
+    """
+    parent = _current.get()
+    if not TRACING_ENABLED or parent is None or parent.trace_id is None:
+        return
+    task = Span(parent.trace_id, parent.span_id, name, attributes)
+    task.start, task.end = started_at, finished_at
+    for child in collected:
+        child["trace_id"] = parent.trace_id
+        child["parent_id"] = child["parent_id"] or task.span_id
+        # Worker processes never call set_service; the spans belong to the service that ran the task
+        child["service"] = _service_name
+        exporter.export(child)
+    exporter.export(task.to_dict())
+
+def traces(trace_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """Returns recent traces recorded by this process, optionally only one trace."""
+    return exporter.traces(trace_id, limit)
+
+class TraceMiddleware:
+    """ASGI middleware that continues the caller's trace (if any) with a server span per HTTP request."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNTRACED_PATHS or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        parent = None
+        for name, value in scope.get("headers", ()):
+            if name == TRACEPARENT_HEADER.encode():
+                parent = parse_traceparent(value.decode("latin-1"))
+                break
+        status = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        with span(f"{scope['method']} {scope['path']}", parent=parent, new_trace=parent is None) as server_span:
+            await self.app(scope, receive, send_wrapper)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                server_span.name = f"{scope['method']} {route}"
+            server_span.set(status_code=status.get("code"))
@@ -0,0 +1,80 @@
+"""
+Binned Gaussian kernel density estimation.
+
+scipy's gaussian_kde, which seaborn uses, sums a kernel per observation at
+every evaluation point: O(n * gridsize). Here observations are first spread
+onto a fine regular grid by linear binning, O(n), and the grid is convolved
+with the sampled Gaussian kernel by FFT, O(m log m) for a grid of m points that
+does not grow with n. The estimate is then interpolated at the same support
+points seaborn uses, with the same (Scott) bandwidth, so the curves agree to
+within a fraction of a percent of the peak density.
+"""
+import math
+import os
+import numpy as np
+from typing import Optional, Tuple
+
+# Histograms of columns with more values than this draw their KDE with binned_kde instead of seaborn's exact path
+KDE_FAST_THRESHOLD = int(os.getenv("KDE_FAST_THRESHOLD", "10000"))
+# Fine grid resolution: points per bandwidth, and bounds on the number of points
+GRID_POINTS_PER_BANDWIDTH = 8
+MIN_GRID_POINTS = 512
+MAX_GRID_POINTS = 2 ** 17
+# The kernel is truncated this many bandwidths from its centre (relative weight there < 4e-6)
+KERNEL_CUTOFF = 5.0
+
+def scott_bandwidth(x: np.ndarray, weights: Optional[np.ndarray] = None) -> float:
+    """
+    Scott's rule as scipy applies it: sample standard deviation times n ** (-1/5),
+    with the weighted deviation and effective sample size when weights are given.
+    """
+    if weights is None:
+        return float(np.std(x, ddof=1)) * len(x) ** (-1 / 5)
+    effective_n = weights.sum() ** 2 / (weights ** 2).sum()
+    return math.sqrt(float(np.cov(x, aweights=weights))) * effective_n ** (-1 / 5)
+
+def binned_kde(x: np.ndarray, gridsize: int = 200, cut: float = 3, bw_adjust: float = 1,
+               weights: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Estimates the density of x, returning (support, density) like seaborn's KDE:
+    `gridsize` points spanning the data extended by `cut` bandwidths on each side.
+    Optional weights count each value that many times, as in gaussian_kde.
+
+    Raises:
+        ValueError: If x has fewer than two finite values or zero variance.
+    """
+    x = np.asarray(x, dtype="float64")
+    finite = np.isfinite(x)
+    x = x[finite]
+    if len(x) < 2:
+        raise ValueError("A density estimate needs at least two finite values.")
+    if weights is not None:
+        weights = np.asarray(weights, dtype="float64")[finite]
+    bw = scott_bandwidth(x, weights) * bw_adjust
+    if not bw > 0:
+        raise ValueError("A density estimate needs values with non-zero variance.")
+
+    low, high = float(x.min()) - cut * bw, float(x.max()) + cut * bw
+    support = np.linspace(low, high, gridsize)
+
+    # Linear binning: each value is split between its two neighbouring grid points
+    points = int(min(max(math.ceil((high - low) / bw * GRID_POINTS_PER_BANDWIDTH) + 1, MIN_GRID_POINTS), MAX_GRID_POINTS))
+    delta = (high - low) / (points - 1)
+    position = (x - low) / delta
+    left = np.minimum(position.astype(np.int64), points - 2)
+    right_weight = position - left
+    left_weight = 1 - right_weight
+    if weights is not None:
+        left_weight, right_weight = left_weight * weights, right_weight * weights
+    counts = np.bincount(left, weights=left_weight, minlength=points)
+    counts += np.bincount(left + 1, weights=right_weight, minlength=points)
+
+    # Linear (not circular) convolution with the kernel sampled on the same grid
+    half_width = min(int(math.ceil(KERNEL_CUTOFF * bw / delta)), points - 1)
+    offsets = np.arange(-half_width, half_width + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bw) ** 2) / (bw * math.sqrt(2 * math.pi) * counts.sum())
+    size = 1 << (points + 2 * half_width).bit_length()
+    grid_density = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)
+    grid_density = np.maximum(grid_density[half_width:half_width + points], 0)
+
+    return support, np.interp(support, low + np.arange(points) * delta, grid_density)
@@ -1,86 +1,359 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import Response
 from pydantic import BaseModel
-from typing import List, Dict, Any
-from . import tools
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
+from common import arrow_ipc, datasets, executor, fast_json, log, metrics, tracing
+from . import render_cache, rendering, sampling, tools, vega
 
 # --- Pydantic Models for Request/Response Validation ---
+# Bodies are read with fast_json.fast_body: Pydantic validates the envelope fields,
+# while 'data' records are checked as they are turned into a DataFrame.
 
-class EdaPayload(BaseModel):
+class DatasetPayload(BaseModel):
     # 'data' is a list of records, like what pandas df.to_dict('records') produces
     data: List[Dict[str, Any]]
-    
-class ChartRequestPayload(EdaPayload):
+
+class EdaPayload(BaseModel):
+    # Either inline records or the id returned by /datasets
+    data: Optional[List[Dict[str, Any]]] = None
+    dataset_id: Optional[str] = None
+
+class ApproximateOptions(BaseModel):
+    # Target half-width of the confidence interval of any bin or category share (0.01 = ±1 point)
+    margin_of_error: float = 0.01
+    confidence_level: float = 0.95
+    # When set, the sample is sized to render within this many milliseconds instead
+    latency_budget_ms: Optional[float] = None
+    # 'stratified' keeps each stratify_by group's share of rows, and at least one row of every group
+    method: Literal["uniform", "stratified"] = "uniform"
+    stratify_by: Optional[str] = None
+    seed: int = 0
+
+class ChartsPayload(EdaPayload):
+    # 'png' returns rendered images; 'vega' returns aggregated data in Vega-Lite specs for the client to draw
+    format: Literal["png", "vega"] = "png"
+    # Opt-in approximate mode: charts are computed on a seeded sample of the dataset
+    approximate: Optional[ApproximateOptions] = None
+
+class ChartRequestPayload(ChartsPayload):
     chart_type: str
     # Optional parameters for specific charts
     params: Dict[str, Any] = {}
 
 # --- FastAPI Application ---
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warms up the render workers in the background and starts the event-loop lag
+    monitor on startup; stops both and the pools on shutdown.
+    """
+    warm_up = asyncio.create_task(
+        executor.run_in_thread(tools.warm_up)
+        if rendering.RENDER_EXECUTOR == "thread"
+        else executor.warm_up_processes(tools.warm_up)
+    )
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    yield
+    warm_up.cancel()
+    lag_monitor.cancel()
+    executor.shutdown()
+
 app = FastAPI(
     title="CanvasLytics EDA Service",
     description="A microservice for performing Exploratory Data Analysis with Pandas and Seaborn.",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=fast_json.ORJSONResponse,
 )
+# Log records carry the X-Request-ID sent by the agent; spans continue the agent's traceparent
+app.add_middleware(log.RequestIdMiddleware)
+# Callers that accept MessagePack (the agent) get chart images as raw bytes instead of base64
+app.add_middleware(fast_json.NegotiationMiddleware)
+app.add_middleware(tracing.TraceMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+tracing.set_service("pandas-eda")
+datasets.use_spill_dir("pandas-eda")
 
 @app.get("/", tags=["Health Check"])
 async def read_root():
     """Root endpoint for health checks."""
     return {"status": "ok", "message": "Pandas-EDA service is running"}
 
-@app.post("/summarize", tags=["EDA"])
-async def get_summary(payload: EdaPayload):
+@app.get("/stats", tags=["Diagnostics"])
+async def read_stats():
+    """Returns dataset store, render cache and worker pool queue metrics."""
+    return {
+        "status": "ok",
+        "datasets": datasets.store.stats(),
+        "render_cache": render_cache.cache.stats(),
+        "executor": executor.stats(),
+    }
+
+@app.get("/metrics", tags=["Diagnostics"])
+async def read_metrics():
+    """Prometheus metrics: route latencies, payload sizes, rows processed, render times and event-loop lag."""
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/debug/traces", tags=["Diagnostics"])
+async def read_traces(trace_id: Optional[str] = None, limit: int = 20):
+    """Returns recent traces recorded by this service, or only the spans of `trace_id`."""
+    return {"status": "ok", "traces": tracing.traces(trace_id, limit)}
+
+@app.post("/datasets", tags=["Datasets"], openapi_extra=fast_json.openapi_body(DatasetPayload))
+async def register_dataset(payload: DatasetPayload = Depends(fast_json.fast_body(DatasetPayload))):
+    """
+    Registers a dataset once so later requests can refer to it by dataset_id.
+    """
+    try:
+        df = await executor.run_in_thread(datasets.records_to_dataframe, payload.data)
+        metrics.record_dataframe("register", df)
+        return await executor.run_in_thread(datasets.register, df)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/datasets/arrow", tags=["Datasets"])
+async def register_arrow_dataset(request: Request):
+    """
+    Registers a dataset sent as an Arrow IPC stream (`application/vnd.apache.arrow.stream`).
+    Columnar and binary, it is much smaller and faster to decode than JSON records.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type != arrow_ipc.ARROW_STREAM_MEDIA_TYPE:
+        raise HTTPException(status_code=415, detail=f"Expected Content-Type '{arrow_ipc.ARROW_STREAM_MEDIA_TYPE}'.")
+    try:
+        df = await executor.run_in_thread(arrow_ipc.dataframe_from_arrow_stream, await request.body())
+        metrics.record_dataframe("register", df)
+        return await executor.run_in_thread(datasets.register, df)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/summarize", tags=["EDA"], openapi_extra=fast_json.openapi_body(EdaPayload))
+async def get_summary(payload: EdaPayload = Depends(fast_json.fast_body(EdaPayload))):
     """
     Receives a dataset and returns a high-level summary.
     """
     try:
-        df = tools.dataframe_from_payload(payload.dict())
-        summary = tools.get_dataset_summary(df)
+        df = await executor.run_in_thread(
+            tools.dataframe_from_payload, {"data": payload.data, "dataset_id": payload.dataset_id}
+        )
+        metrics.record_dataframe("summarize", df)
+        summary = await executor.run_in_thread(tools.get_dataset_summary, df)
         return {"status": "success", "summary": summary}
+    except datasets.DatasetNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/initial-visualizations", tags=["Visualizations"])
-async def create_initial_visualizations(payload: EdaPayload):
+class ChartRenderer:
+    """
+    Produces the charts of one dataset in the requested format.
+
+    PNGs go through the render cache. Misses are drawn in the process pool, with
+    the dataset shared with the workers on the first miss only, or on the thread
+    pool with RENDER_EXECUTOR=thread; a board whose charts are all cached does no
+    rendering and writes no files. Vega-Lite specs are aggregated on the
+    thread pool and not cached, as they cost far less than a render.
+
+    In approximate mode every chart is computed on one seeded sample, which is
+    small enough to hand to a worker directly; `approximation` describes it.
+
+    The shared file stays pinned while renders that read it are queued or running;
+    call close() once the request is done with the renderer to release it.
+    """
+    def __init__(self, df, dataset_id: Optional[str], format: str = "png", sample: Optional[sampling.Sample] = None):
+        self.df = df
+        self.dataset_id = dataset_id
+        self.format = format
+        self.sample = sample
+        self.approximation = sample.report if sample is not None else None
+        self._shared: Optional[asyncio.Future] = None
+        self._readers = 0
+        self._closed = False
+
+    @classmethod
+    async def for_payload(cls, df, payload: ChartsPayload) -> "ChartRenderer":
+        dataset_id = payload.dataset_id
+        # Inline data is registered so its PNGs are keyed by the same content fingerprint
+        if dataset_id is None and payload.format == "png":
+            dataset_id = await executor.run_in_thread(datasets.store.put, df)
+        sample = None
+        if payload.approximate is not None:
+            options = payload.approximate
+            sample = await executor.run_in_thread(
+                sampling.draw_sample, df, options.margin_of_error, options.confidence_level,
+                options.latency_budget_ms, options.method, options.stratify_by, options.seed,
+            )
+        return cls(df, dataset_id, payload.format, sample)
+
+    async def render(self, chart: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the chart entry with its PNG 'image' (raw bytes, sent as 'image_base64'
+        in JSON responses), or its 'format' and Vega-Lite 'spec'.
+        """
+        chart_type, column = chart["chart_type"], chart.get("column")
+        # A sample that kept every row is the exact chart
+        sampled = self.sample is not None and self.sample.weights is not None
+        if self.format == "vega":
+            if sampled:
+                spec = await executor.run_in_thread(vega.chart_spec, self.sample.frame, chart_type, column, self.sample.weights)
+            else:
+                spec = await executor.run_in_thread(vega.chart_spec, self.df, chart_type, column)
+            return {**chart, "format": "vega", "spec": spec}
+
+        async def render_in_worker():
+            if sampled:
+                run = executor.run_in_thread if rendering.RENDER_EXECUTOR == "thread" else executor.run_in_process
+                return await run(tools.draw_chart, self.sample.frame, chart_type, column, self.sample.weights)
+            if rendering.RENDER_EXECUTOR == "thread":
+                return await executor.run_in_thread(tools.draw_chart, self.df, chart_type, column)
+            self._readers += 1
+            try:
+                if self._shared is None:
+                    self._shared = asyncio.ensure_future(
+                        executor.run_in_thread(tools.share_dataframe, self.df, self.dataset_id, True)
+                    )
+                dataset = await asyncio.shield(self._shared)
+                return await executor.run_in_process(tools.render_chart, dataset, chart_type, column)
+            finally:
+                self._readers -= 1
+                self._unpin_when_idle()
+
+        sample_key = None
+        if sampled:
+            # The seed, size and method pin the sample down, so approximate images are cached like exact ones
+            report = self.approximation
+            sample_key = {name: report.get(name) for name in ("method", "seed", "sample_size", "stratify_by")}
+        key = render_cache.chart_key(self.dataset_id, chart_type, column, sample_key)
+        return {**chart, "image": await render_cache.cache.get_or_render(key, render_in_worker)}
+
+    def close(self):
+        """Releases the shared file's pin, at once or when the last render still reading it ends."""
+        self._closed = True
+        self._unpin_when_idle()
+
+    def _unpin_when_idle(self):
+        # Renders live on in the render cache while another request waits on them, so they may outlast close()
+        if not self._closed or self._readers or self._shared is None:
+            return
+        shared, self._shared = self._shared, None
+        shared.add_done_callback(_unpin_shared)
+
+def _unpin_shared(shared: asyncio.Future):
+    if not shared.cancelled() and shared.exception() is None:
+        datasets.store.unpin(shared.result()[0])
+
+async def _prepare_initial_charts(df, payload: ChartsPayload):
+    """Lists the default charts for df and returns them with the renderer for its dataset."""
+    metrics.record_dataframe("initial_visualizations", df)
+    charts = tools.initial_chart_specs(df)
+    renderer = await ChartRenderer.for_payload(df, payload)
+    return charts, renderer
+
+def _render_tasks(charts: List[Dict[str, Any]], renderer: ChartRenderer) -> List[asyncio.Task]:
+    """Starts one render per chart; PNG cache misses run in parallel across the process pool."""
+    return [asyncio.ensure_future(renderer.render(chart)) for chart in charts]
+
+@app.post("/initial-visualizations", tags=["Visualizations"], openapi_extra=fast_json.openapi_body(ChartsPayload))
+async def create_initial_visualizations(payload: ChartsPayload = Depends(fast_json.fast_body(ChartsPayload))):
     """
-    Generates a set of default visualizations for a given dataset.
+    Generates a set of default visualizations for a given dataset, as PNG images
+    or, with format=vega, as Vega-Lite specs. With 'approximate' set, charts are
+    computed on a sample and the response reports it under 'approximation'.
     """
+    # Returned as a response so FastAPI's jsonable_encoder never sees the raw PNG bytes
+    return fast_json.ORJSONResponse(await initial_visualizations(payload))
+
+async def initial_visualizations(payload: ChartsPayload) -> Dict[str, Any]:
+    """Renders the default board; errors are raised as HTTPException."""
     try:
-        df = tools.dataframe_from_payload(payload.dict())
-        charts = []
+        df = await executor.run_in_thread(
+            tools.dataframe_from_payload, {"data": payload.data, "dataset_id": payload.dataset_id}
+        )
+        charts, renderer = await _prepare_initial_charts(df, payload)
 
-        # Generate a correlation heatmap for all numeric columns
+        # Cached charts return at once and the rest render in parallel; gather keeps the board order
         try:
-            heatmap_b64 = tools.generate_correlation_heatmap(df)
-            charts.append({
-                "chart_name": "Correlation Heatmap",
-                "chart_type": "heatmap",
-                "image_base64": heatmap_b64
-            })
-        except ValueError as e:
-            print(f"Skipping heatmap: {e}")
-
-        # Generate histograms for numeric columns
-        numeric_cols = df.select_dtypes(include=['number']).columns
-        for col in numeric_cols:
-            hist_b64 = tools.generate_histogram(df, col)
-            charts.append({
-                "chart_name": f"Distribution of {col}",
-                "chart_type": "histogram",
-                "column": col,
-                "image_base64": hist_b64
-            })
-            
-        return {"status": "success", "charts": charts}
+            charts = await asyncio.gather(*_render_tasks(charts, renderer))
+        finally:
+            renderer.close()
+        response = {"status": "success", "charts": charts}
+        if renderer.approximation is not None:
+            response["approximation"] = renderer.approximation
+        return response
+    except datasets.DatasetNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/initial-visualizations/stream", tags=["Visualizations"], openapi_extra=fast_json.openapi_body(ChartsPayload))
+async def stream_initial_visualizations(payload: ChartsPayload = Depends(fast_json.fast_body(ChartsPayload))):
+    """
+    Streams the default visualizations as NDJSON (MessagePack for callers that accept it),
+    one line per chart as soon as it is rendered.
+
+    Lines are a 'started' event listing the charts (without images) and, in approximate
+    mode, the sample's 'approximation', then one 'partial' event per chart in completion
+    order with its board 'index', then a 'complete' event.
+    A failure after streaming has begun is reported as an 'error' event.
+    """
+    return fast_json.event_stream(await initial_visualization_events(payload))
+
+async def initial_visualization_events(payload: ChartsPayload) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Loads the dataset and lists the charts, then returns the iterator of stream
+    events; errors up to that point are raised as HTTPException.
+    """
+    try:
+        df = await executor.run_in_thread(
+            tools.dataframe_from_payload, {"data": payload.data, "dataset_id": payload.dataset_id}
+        )
+        charts, renderer = await _prepare_initial_charts(df, payload)
+    except datasets.DatasetNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/generate-chart", tags=["Visualizations"])
-async def generate_single_chart(payload: ChartRequestPayload):
+    async def events():
+        started = {"status": "started", "chart_count": len(charts), "charts": charts}
+        if renderer.approximation is not None:
+            started["approximation"] = renderer.approximation
+        yield started
+        tasks = _render_tasks(charts, renderer)
+        index_of = {task: index for index, task in enumerate(tasks)}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=index_of.get):
+                    index = index_of[task]
+                    yield {"status": "partial", "index": index, "chart": task.result()}
+            yield {"status": "complete", "chart_count": len(charts)}
+        except Exception as e:
+            yield {"status": "error", "detail": str(e)}
+        finally:
+            # Client went away or a chart failed: drop renders that have not started yet
+            for task in tasks:
+                task.cancel()
+            renderer.close()
+
+    return events()
+
+@app.post("/generate-chart", tags=["Visualizations"], openapi_extra=fast_json.openapi_body(ChartRequestPayload))
+async def generate_single_chart(payload: ChartRequestPayload = Depends(fast_json.fast_body(ChartRequestPayload))):
     """
-    Generates a single, specified chart.
+    Generates a single, specified chart, exactly or, with 'approximate' set, from a sample.
     """
+    return fast_json.ORJSONResponse(await single_chart(payload))
+
+async def single_chart(payload: ChartRequestPayload) -> Dict[str, Any]:
+    """Renders one chart; errors are raised as HTTPException."""
     try:
-        df = tools.dataframe_from_payload(payload.dict())
+        df = await executor.run_in_thread(
+            tools.dataframe_from_payload, {"data": payload.data, "dataset_id": payload.dataset_id}
+        )
         chart_type = payload.chart_type
         params = payload.params
         column = params.get("column")
@@ -88,21 +361,37 @@ async def generate_single_chart(payload: ChartRequestPayload):
         if not column:
             raise ValueError("Parameter 'column' is required for chart generation.")
 
-        if chart_type == "histogram":
-            image_b64 = tools.generate_histogram(df, column)
-        elif chart_type == "bar_chart":
-            image_b64 = tools.generate_bar_chart(df, column)
-        else:
+        if chart_type not in ("histogram", "bar_chart"):
             raise HTTPException(status_code=400, detail=f"Chart type '{chart_type}' not supported.")
 
-        return {
-            "status": "success",
-            "chart_info": {
+        metrics.record_dataframe("generate_chart", df)
+        renderer = await ChartRenderer.for_payload(df, payload)
+        try:
+            chart_info = await renderer.render({
                 "chart_name": f"{chart_type.replace('_', ' ').title()} of {column}",
                 "chart_type": chart_type,
                 "column": column,
-                "image_base64": image_b64,
-            },
-        }
+            })
+        finally:
+            renderer.close()
+        response = {"status": "success", "chart_info": chart_info}
+        if renderer.approximation is not None:
+            response["approximation"] = renderer.approximation
+        return response
+    except datasets.DatasetNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Routes the agent calls directly in monolith mode (TOOL_DISPATCH=inprocess): path -> (body model, handler).
+# Handlers take the validated body and raise HTTPException exactly as over HTTP.
+IN_PROCESS_ROUTES = {
+    "/datasets": (DatasetPayload, register_dataset),
+    "/summarize": (EdaPayload, get_summary),
+    "/initial-visualizations": (ChartsPayload, initial_visualizations),
+    "/generate-chart": (ChartRequestPayload, single_chart),
+}
+# Streaming routes: path -> (body model, function returning the iterator of events)
+IN_PROCESS_STREAMS = {
+    "/initial-visualizations/stream": (ChartsPayload, initial_visualization_events),
+}
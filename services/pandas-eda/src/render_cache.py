@@ -0,0 +1,133 @@
+"""
+Cache of rendered chart images.
+
+Charts are keyed by (dataset_id, chart type, column, style, size), plus the
+sample for approximate charts. dataset_id is the content fingerprint of the
+data, so a changed dataset gets new keys and old images are never served for
+it; they simply age out of the LRU tiers.
+
+The memory tier holds raw PNG bytes in an LRU bounded by bytes; they are only
+base64 encoded when a JSON response is written. When RENDER_CACHE_DIR is set,
+images are also written through to PNG files there, bounded by bytes with the
+least-recently-used files removed first, so they survive restarts and are
+shared by every worker of the service.
+"""
+import hashlib
+import orjson
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from common import caching, executor, metrics
+from . import rendering
+
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Leave RENDER_CACHE_DIR empty to keep rendered charts in memory only
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "canvaslytics-renders"))
+RENDER_CACHE_DISK_MAX_BYTES = int(os.getenv("RENDER_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Part of every key; bump it when chart drawing code changes so images cached on disk are not reused
+RENDER_REVISION = 2
+
+RENDER_CACHE_LOOKUPS = metrics.counter(
+    "canvaslytics_render_cache_lookups_total",
+    "Chart render cache lookups by outcome (memory, disk, coalesced or miss).",
+    ("outcome",),
+)
+
+def chart_key(dataset_id: str, chart_type: str, column: Optional[str] = None, sample: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Returns the cache key of a chart of a registered dataset, drawn with the
+    current style and size; `sample` identifies the seeded sample of an approximate chart.
+    """
+    spec = [RENDER_REVISION, dataset_id, chart_type, column, rendering.CHART_STYLE, rendering.CHART_SIZES.get(chart_type)]
+    if sample is not None:
+        spec.append(sample)
+    return hashlib.sha256(orjson.dumps(spec)).hexdigest()[:32]
+
+class RenderCache:
+    """
+    Two-tier cache of rendered charts (PNG bytes).
+
+    Concurrent lookups of the same missing chart share one render. Memory-tier
+    methods run on the event loop; disk I/O runs in the thread pool.
+    """
+    def __init__(self, max_bytes: int = RENDER_CACHE_MAX_BYTES, disk_dir: str = RENDER_CACHE_DIR,
+                 disk_max_bytes: int = RENDER_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._disk = caching.DiskLRU(disk_dir, disk_max_bytes, ".png") if disk_dir else None
+        self._renders = caching.SingleFlight()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get_or_render(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        """
+        Returns the cached image for key, or awaits render() and caches its result.
+        Failed renders are not cached.
+        """
+        png = self._entries.get(key)
+        if png is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            RENDER_CACHE_LOOKUPS.labels("memory").inc()
+            return png
+        if key in self._renders:
+            RENDER_CACHE_LOOKUPS.labels("coalesced").inc()
+        # A render nobody waits for any more (e.g. a closed board stream) is cancelled; later lookups render afresh
+        return await self._renders.do(key, lambda: self._load_or_render(key, render))
+
+    async def _load_or_render(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        if self._disk is not None:
+            png = await executor.run_in_thread(self._disk.read, key)
+            if png is not None:
+                self.disk_hits += 1
+                RENDER_CACHE_LOOKUPS.labels("disk").inc()
+                self._store(key, png)
+                return png
+
+        self.misses += 1
+        RENDER_CACHE_LOOKUPS.labels("miss").inc()
+        png = await render()
+        self._store(key, png)
+        if self._disk is not None:
+            await executor.run_in_thread(self._disk.write, key, png)
+        return png
+
+    def stats(self) -> Dict[str, Any]:
+        coalesced = self._renders.coalesced
+        lookups = self.hits + self.disk_hits + coalesced + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk_entries": len(self._disk) if self._disk is not None else 0,
+            "disk_bytes": self._disk.bytes if self._disk is not None else 0,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": coalesced,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "in_flight": len(self._renders),
+            "hit_ratio": (lookups - self.misses) / lookups if lookups else None,
+        }
+
+    def _store(self, key: str, png: bytes):
+        if len(png) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = png
+        self._bytes += len(png)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+# Process-wide cache used by the chart routes
+cache = RenderCache()
@@ -0,0 +1,74 @@
+"""
+Chart rendering on matplotlib's object-oriented API.
+
+Charts are drawn on Figures with their own Agg canvas, never through pyplot's
+global figure manager, so nothing has to be closed and nothing is registered
+between requests. The chart style is applied to rcParams once, at import;
+afterwards rcParams are only read. Each thread keeps one figure per chart type
+and resets it after every chart instead of building a new one, so concurrent
+renders on different threads never share a figure.
+"""
+import io
+import os
+import threading
+import matplotlib.style
+from contextlib import contextmanager
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from typing import Dict, Iterator
+from common import tracing
+
+# Look of every chart; both are part of the render cache key
+CHART_STYLE = 'seaborn-v0_8-whitegrid'
+CHART_SIZES = {"histogram": (7, 5), "bar_chart": (7, 5), "heatmap": (8, 6)}
+# Where PNG charts are drawn: 'process' (the shared process pool) or 'thread' (the thread pool, no dataset hand-off)
+RENDER_EXECUTOR = os.getenv("RENDER_EXECUTOR", "process")
+
+matplotlib.style.use(CHART_STYLE)
+
+class FigureTemplate:
+    """
+    A figure and axes sized for one chart type, reused from chart to chart.
+
+    Clearing the axes is cheaper than building new ones, and a template only
+    ever draws its own chart type, so any state a chart leaves on the axes that
+    clear() does not reset is set the same way by the next chart anyway.
+    """
+    def __init__(self, chart_type: str):
+        self.figure = Figure(figsize=CHART_SIZES[chart_type])
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+
+    def reset(self):
+        """Removes what the last chart drew."""
+        for mappable in (*self.axes.collections, *self.axes.images):
+            # Colorbar.remove also gives the axes back the space and anchor the colorbar took
+            if getattr(mappable, "colorbar", None) is not None:
+                mappable.colorbar.remove()
+        self.axes.clear()
+
+_templates = threading.local()
+
+@contextmanager
+def axes(chart_type: str) -> Iterator[Axes]:
+    """Yields blank axes for chart_type from this thread's template, which is reset when the block exits."""
+    templates: Dict[str, FigureTemplate] = _templates.__dict__.setdefault("templates", {})
+    # Popped while in use, so a nested render of the same type gets a template of its own
+    template = templates.pop(chart_type, None) or FigureTemplate(chart_type)
+    yield template.axes
+    # Only reached on success: a chart that failed part-way is dropped with its template
+    template.reset()
+    templates[chart_type] = template
+
+def png(ax: Axes) -> bytes:
+    """
+    Draws the figure holding ax and returns it as PNG bytes. Charts stay raw bytes
+    up to the response; only JSON responses base64 encode them.
+    """
+    buf = io.BytesIO()
+    # savefig draws the figure and compresses the PNG
+    with tracing.span("rasterize") as span:
+        ax.figure.savefig(buf, format="png", bbox_inches="tight")
+        span.set(png_bytes=buf.getbuffer().nbytes)
+    return buf.getvalue()
@@ -0,0 +1,157 @@
+"""
+Samples for approximate charts.
+
+A chart of a 10M-row column looks the same drawn from a well-sized sample. The
+sample size comes from a target margin of error for the share of rows in any
+histogram bin or category (worst case p = 0.5, with finite population
+correction), or from a latency budget through a simple cost model. Samples are
+seeded, so the same request always gets the same sample (and the same cached
+image).
+
+Rows carry weights (population rows each sampled row stands for), so counts
+drawn from a sample estimate the full dataset's counts.
+"""
+import math
+import os
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+from typing import Any, Dict, Optional
+
+# Cost model for latency budgets: a chart render costs a fixed part plus this many rows per second
+APPROX_FIXED_COST_MS = float(os.getenv("APPROX_FIXED_COST_MS", "250"))
+APPROX_ROWS_PER_SECOND = float(os.getenv("APPROX_ROWS_PER_SECOND", "1000000"))
+# Samples are never smaller than this, whatever the budget
+MIN_SAMPLE_SIZE = int(os.getenv("APPROX_MIN_SAMPLE_SIZE", "1000"))
+
+class Sample:
+    """A sampled frame with per-row weights (None when every row was kept) and its report for the response."""
+    def __init__(self, frame: pd.DataFrame, weights: Optional[np.ndarray], report: Dict[str, Any]):
+        self.frame = frame
+        self.weights = weights
+        self.report = report
+
+def _z(confidence_level: float) -> float:
+    return NormalDist().inv_cdf(0.5 + confidence_level / 2)
+
+def size_for_margin(population: int, margin_of_error: float, confidence_level: float) -> int:
+    """Rows needed so any proportion is within ±margin_of_error at confidence_level: z²·0.25/e², with FPC."""
+    n0 = _z(confidence_level) ** 2 * 0.25 / margin_of_error ** 2
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+def size_for_latency(population: int, latency_budget_ms: float) -> int:
+    """Rows a chart can be drawn from within latency_budget_ms according to the cost model."""
+    rows = (latency_budget_ms - APPROX_FIXED_COST_MS) / 1000 * APPROX_ROWS_PER_SECOND
+    return min(population, max(MIN_SAMPLE_SIZE, int(rows)))
+
+def margin_of_error(sample_size: int, population: int, confidence_level: float) -> float:
+    """Half-width of the confidence interval for a proportion (worst case p = 0.5) from a simple random sample."""
+    if sample_size >= population:
+        return 0.0
+    return _z(confidence_level) * math.sqrt(0.25 / sample_size * (population - sample_size) / (population - 1))
+
+def correlation_margin(sample_size: int, population: int, confidence_level: float) -> float:
+    """Half-width of the Fisher z confidence interval for a correlation near 0, where it is widest."""
+    if sample_size >= population:
+        return 0.0
+    if sample_size <= 3:
+        return 1.0
+    return math.tanh(_z(confidence_level) / math.sqrt(sample_size - 3))
+
+def weighted_value_counts(series: pd.Series, weights: np.ndarray) -> pd.Series:
+    """Estimated population count of each non-null value of a sampled series, most frequent first."""
+    totals = pd.Series(weights, index=series.index).groupby(series, observed=True, dropna=True).sum()
+    return totals.sort_values(ascending=False, kind="stable")
+
+def _uniform_positions(population: int, size: int, rng: np.random.Generator) -> np.ndarray:
+    # A simple random sample without replacement, the same distribution a reservoir sampler yields;
+    # the frame is in memory, so positions are drawn directly
+    return np.sort(rng.choice(population, size=size, replace=False))
+
+def _stratified_positions(codes: np.ndarray, size: int, rng: np.random.Generator):
+    """
+    Proportional allocation with at least one row per stratum, so rare groups
+    still appear. Returns (positions, weight of each sampled row, strata count).
+    """
+    strata_sizes = np.bincount(codes)
+    allocation = np.minimum(strata_sizes, np.maximum(1, np.rint(size * strata_sizes / len(codes)))).astype(np.int64)
+    # Each stratum keeps its allocation[h] rows with the smallest random keys. Sorting every
+    # row is slow on large frames, so rows are first thinned to those with keys under a
+    # threshold that leaves enough candidates (by several standard deviations) in each stratum
+    keys = rng.random(len(codes))
+    share = allocation / strata_sizes
+    threshold = np.minimum(1.0, share + 6 * np.sqrt(share * (1 - share) / strata_sizes) + 1 / strata_sizes)
+    while True:
+        candidates = np.flatnonzero(keys < threshold[codes])
+        candidate_counts = np.bincount(codes[candidates], minlength=len(strata_sizes))
+        short = candidate_counts < allocation
+        if not short.any():
+            break
+        threshold[short] = 1.0
+    candidate_codes = codes[candidates]
+    order = np.lexsort((keys[candidates], candidate_codes))
+    sorted_codes = candidate_codes[order]
+    starts = np.concatenate(([0], np.cumsum(candidate_counts)[:-1]))
+    rank = np.arange(len(order)) - starts[sorted_codes]
+    keep = rank < allocation[sorted_codes]
+    positions, kept_codes = candidates[order[keep]], sorted_codes[keep]
+    by_position = np.argsort(positions)
+    weights = (strata_sizes / allocation)[kept_codes]
+    return positions[by_position], weights[by_position], len(strata_sizes)
+
+def draw_sample(
+    df: pd.DataFrame,
+    margin_of_error_target: float = 0.01,
+    confidence_level: float = 0.95,
+    latency_budget_ms: Optional[float] = None,
+    method: str = "uniform",
+    stratify_by: Optional[str] = None,
+    seed: int = 0,
+) -> Sample:
+    """
+    Draws a seeded sample of df sized for margin_of_error_target, or for
+    latency_budget_ms when given. method is 'uniform' or 'stratified' (by the
+    stratify_by column).
+
+    Raises:
+        ValueError: If an option is out of range, or stratify_by is missing or not a column of df.
+    """
+    if not 0 < margin_of_error_target < 0.5:
+        raise ValueError("margin_of_error must be between 0 and 0.5.")
+    if not 0 < confidence_level < 1:
+        raise ValueError("confidence_level must be between 0 and 1.")
+    if latency_budget_ms is not None and latency_budget_ms <= 0:
+        raise ValueError("latency_budget_ms must be positive.")
+    population = len(df)
+    if latency_budget_ms is not None:
+        size, sized_for = size_for_latency(population, latency_budget_ms), "latency_budget_ms"
+    else:
+        size, sized_for = size_for_margin(population, margin_of_error_target, confidence_level), "margin_of_error"
+    if method == "stratified" and stratify_by not in df.columns:
+        raise ValueError(f"Stratified sampling needs 'stratify_by' set to a column of the dataset, got {stratify_by!r}.")
+
+    rng = np.random.default_rng(seed)
+    report: Dict[str, Any] = {"method": method, "seed": seed, "sized_for": sized_for}
+    weights = None
+    if size >= population:
+        frame = df
+    elif method == "stratified":
+        codes, _ = pd.factorize(df[stratify_by], use_na_sentinel=False)
+        positions, weights, strata = _stratified_positions(codes, size, rng)
+        frame = df.iloc[positions].reset_index(drop=True)
+        report.update(stratify_by=stratify_by, strata=strata)
+    else:
+        frame = df.iloc[_uniform_positions(population, size, rng)].reset_index(drop=True)
+        weights = np.full(len(frame), population / len(frame))
+
+    sample_size = len(frame)
+    report.update(
+        sample_size=sample_size,
+        population_size=population,
+        sampling_fraction=sample_size / population if population else 1.0,
+        confidence_level=confidence_level,
+        # Bounds of a simple random sample; proportional stratification only narrows them
+        margin_of_error=margin_of_error(sample_size, population, confidence_level),
+        correlation_margin=correlation_margin(sample_size, population, confidence_level),
+    )
+    return Sample(frame, weights, report)
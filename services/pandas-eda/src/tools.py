@@ -1,16 +1,21 @@
+import numpy as np
 import pandas as pd
 import seaborn as sns
-import matplotlib.pyplot as plt
-import io
-import base64
-from typing import List, Dict, Any
+from matplotlib.colors import to_rgba
+import os
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from common import datasets, log
+from . import kde, rendering, sampling
+
+logger = log.get_logger("pandas-eda.tools")
 
 def dataframe_from_payload(payload: Dict[str, Any]) -> pd.DataFrame:
-    """Creates a pandas DataFrame from the 'data' key in a JSON payload."""
-    data = payload.get("data")
-    if not data or not isinstance(data, list):
-        raise ValueError("Payload must contain a 'data' key with a list of records.")
-    return pd.DataFrame(data)
+    """
+    Creates a pandas DataFrame from the 'data' key in a JSON payload,
+    or returns the registered dataset named by its 'dataset_id' key.
+    """
+    return datasets.resolve_dataframe(payload.get("data"), payload.get("dataset_id"))
 
 def get_dataset_summary(df: pd.DataFrame) -> Dict[str, Any]:
     """
@@ -29,56 +34,157 @@ def get_dataset_summary(df: pd.DataFrame) -> Dict[str, Any]:
     }
     return summary
 
-def generate_plot_base64(fig) -> str:
+def generate_histogram(df: pd.DataFrame, column: str, weights: Optional[np.ndarray] = None) -> bytes:
     """
-    Converts a matplotlib figure to a base64 encoded string.
+    Generates a histogram for a given numerical column and returns it as PNG bytes.
+    With per-row weights (a sample), the bars show estimated population counts.
     """
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight")
-    plt.close(fig)  # Close the figure to free up memory
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode('utf-8')
-    return img_str
-
-def generate_histogram(df: pd.DataFrame, column: str) -> str:
-    """Generates a histogram for a given numerical column and returns it as a base64 string."""
     if column not in df.columns:
         raise ValueError(f"Column '{column}' not found in DataFrame.")
     
-    plt.style.use('seaborn-v0_8-whitegrid')
-    fig, ax = plt.subplots(figsize=(7, 5))
-    sns.histplot(df[column], kde=True, ax=ax)
-    ax.set_title(f'Distribution of {column}')
-    ax.set_xlabel(column)
-    ax.set_ylabel('Frequency')
-    
-    return generate_plot_base64(fig)
+    values = df[column]
+    numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+    # seaborn's exact KDE costs O(rows x gridsize); large numeric columns use the binned FFT estimate
+    fast_kde = len(values) > kde.KDE_FAST_THRESHOLD and numeric
+    bins = "auto"
+    if weights is not None and numeric:
+        # histplot falls back to 10 bins for weighted data; use the bins 'auto' picks for the sample
+        finite = values.to_numpy(dtype="float64", na_value=np.nan)
+        bins = np.histogram_bin_edges(finite[np.isfinite(finite)], bins="auto").tolist()
+    with rendering.axes("histogram") as ax:
+        if fast_kde:
+            # Bars are drawn as translucent as histplot draws them under a KDE curve
+            sns.histplot(x=values, weights=weights, bins=bins, alpha=0.5, ax=ax)
+            add_histogram_kde(ax, values, weights)
+        else:
+            sns.histplot(x=values, weights=weights, bins=bins, kde=True, ax=ax)
+        ax.set_title(f'Distribution of {column}')
+        ax.set_xlabel(column)
+        ax.set_ylabel('Frequency')
+        return rendering.png(ax)
+
+def add_histogram_kde(ax, values: pd.Series, weights: Optional[np.ndarray] = None) -> None:
+    """
+    Draws the KDE curve of a histogram the way sns.histplot(kde=True) does: on
+    the data range (cut=0), scaled to the bars' total area, in the bar colour.
+    """
+    try:
+        support, density = kde.binned_kde(values.to_numpy(dtype="float64", na_value=np.nan), cut=0, weights=weights)
+    except ValueError:
+        return  # Fewer than two values or no variance: seaborn skips the curve too
+    bars = ax.patches
+    density *= sum(bar.get_height() * bar.get_width() for bar in bars)
+    line, = ax.plot(support, density, color=to_rgba(bars[0].get_facecolor(), 1))
+    line.sticky_edges.y[:] = (0, np.inf)
 
-def generate_bar_chart(df: pd.DataFrame, column: str) -> str:
-    """Generates a bar chart for a given categorical column and returns it as a base64 string."""
+def generate_bar_chart(df: pd.DataFrame, column: str, weights: Optional[np.ndarray] = None) -> bytes:
+    """
+    Generates a bar chart for a given categorical column and returns it as PNG bytes.
+    With per-row weights (a sample), the bars show estimated population counts.
+    """
     if column not in df.columns:
         raise ValueError(f"Column '{column}' not found in DataFrame.")
     
-    plt.style.use('seaborn-v0_8-whitegrid')
-    fig, ax = plt.subplots(figsize=(7, 5))
-    sns.countplot(y=df[column], ax=ax, order=df[column].value_counts().index)
-    ax.set_title(f'Count of {column}')
-    ax.set_xlabel('Count')
-    ax.set_ylabel(column)
-    
-    return generate_plot_base64(fig)
+    with rendering.axes("bar_chart") as ax:
+        if weights is None:
+            sns.countplot(y=df[column], ax=ax, order=df[column].value_counts().index)
+        else:
+            # countplot cannot weight rows, so the weighted counts are drawn as plain bars
+            counts = sampling.weighted_value_counts(df[column], weights)
+            sns.barplot(x=counts.to_numpy(), y=counts.index, order=counts.index, orient="h", errorbar=None, ax=ax)
+        ax.set_title(f'Count of {column}')
+        ax.set_xlabel('Count')
+        ax.set_ylabel(column)
+        return rendering.png(ax)
 
-def generate_correlation_heatmap(df: pd.DataFrame) -> str:
-    """Generates a correlation heatmap for numerical columns and returns it as a base64 string."""
+def generate_correlation_heatmap(df: pd.DataFrame) -> bytes:
+    """Generates a correlation heatmap for numerical columns and returns it as PNG bytes."""
     numeric_df = df.select_dtypes(include=['number'])
     if numeric_df.shape[1] < 2:
         raise ValueError("Not enough numeric columns for a correlation heatmap.")
     
     corr = numeric_df.corr()
     
-    plt.style.use('seaborn-v0_8-whitegrid')
-    fig, ax = plt.subplots(figsize=(8, 6))
-    sns.heatmap(corr, annot=True, fmt=".2f", cmap="coolwarm", ax=ax)
-    ax.set_title('Correlation Heatmap')
-    
-    return generate_plot_base64(fig)
\ No newline at end of file
+    with rendering.axes("heatmap") as ax:
+        sns.heatmap(corr, annot=True, fmt=".2f", cmap="coolwarm", ax=ax)
+        ax.set_title('Correlation Heatmap')
+        return rendering.png(ax)
+
+def initial_chart_specs(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Lists the default board, in display order: a correlation heatmap plus a
+    histogram per numeric column. Images are filled in by render_chart.
+    """
+    charts = []
+    numeric_cols = df.select_dtypes(include=['number']).columns
+
+    # Generate a correlation heatmap for all numeric columns
+    if len(numeric_cols) >= 2:
+        charts.append({
+            "chart_name": "Correlation Heatmap",
+            "chart_type": "heatmap",
+        })
+    else:
+        logger.info("Skipping heatmap: not enough numeric columns for a correlation heatmap")
+
+    # Generate histograms for numeric columns
+    for col in numeric_cols:
+        charts.append({
+            "chart_name": f"Distribution of {col}",
+            "chart_type": "histogram",
+            "column": col,
+        })
+
+    return charts
+
+# --- Rendering in worker processes ---
+# A dataset is handed to workers as (dataset_id, path to its Arrow file). Each worker
+# loads it once and keeps it in a small LRU, so charts of the same board do not pickle
+# the DataFrame per task.
+
+SHARED_FRAMES_PER_WORKER = int(os.getenv("RENDER_WORKER_CACHED_DATASETS", "4"))
+_shared_frames: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+
+def share_dataframe(df: pd.DataFrame, dataset_id: Optional[str] = None, pin: bool = False) -> Tuple[str, str]:
+    """
+    Registers df if needed and returns the (dataset_id, path) reference render_chart expects;
+    with pin=True the file is kept until datasets.store.unpin(dataset_id).
+    """
+    return datasets.share(df, dataset_id, pin)
+
+def load_shared_dataframe(dataset: Tuple[str, str]) -> pd.DataFrame:
+    """Returns the DataFrame behind a share_dataframe reference, loading it at most once per process."""
+    dataset_id, path = dataset
+    # When rendering in the serving process itself, the frame is usually still resident
+    df = datasets.store.peek(dataset_id)
+    if df is not None:
+        return df
+    df = _shared_frames.get(dataset_id)
+    if df is None:
+        df = _shared_frames[dataset_id] = datasets.read_dataset_file(path)
+        while len(_shared_frames) > SHARED_FRAMES_PER_WORKER:
+            _shared_frames.popitem(last=False)
+    _shared_frames.move_to_end(dataset_id)
+    return df
+
+def warm_up() -> None:
+    """Renders a tiny chart so a fresh worker has matplotlib, seaborn and the font cache loaded."""
+    generate_histogram(pd.DataFrame({"x": [0.0, 1.0, 2.0]}), "x")
+
+def draw_chart(df: pd.DataFrame, chart_type: str, column: Optional[str] = None,
+               weights: Optional[np.ndarray] = None) -> bytes:
+    """
+    Renders one chart of df and returns it as PNG bytes. Safe to call from several threads.
+    weights are the per-row weights of a sample; correlations are taken on the sample as drawn.
+    """
+    if chart_type == "heatmap":
+        return generate_correlation_heatmap(df)
+    if chart_type == "histogram":
+        return generate_histogram(df, column, weights)
+    if chart_type == "bar_chart":
+        return generate_bar_chart(df, column, weights)
+    raise ValueError(f"Chart type '{chart_type}' not supported.")
+
+def render_chart(dataset: Tuple[str, str], chart_type: str, column: Optional[str] = None) -> bytes:
+    """Renders one chart of a shared dataset and returns it as PNG bytes. Runs in a worker process."""
+    return draw_chart(load_shared_dataframe(dataset), chart_type, column)
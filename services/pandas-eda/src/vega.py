@@ -0,0 +1,159 @@
+"""
+Vega-Lite output for charts (format=vega).
+
+Instead of rasterizing, the service computes the aggregates a chart needs
+(histogram bins, category counts, the correlation matrix) and returns them
+inlined in a Vega-Lite spec that the client renders. A spec is a few KB however
+large the dataset is, and aggregating costs a fraction of drawing a PNG.
+"""
+import math
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+from . import rendering, sampling
+
+VEGA_LITE_SCHEMA = "https://vega.github.io/schema/vega-lite/v5.json"
+# Specs keep the proportions of the PNG charts: figure inches times this many pixels
+PIXELS_PER_INCH = 72
+# Histograms use numpy's 'auto' bins, like seaborn, capped at this many
+MAX_BINS = 100
+# Bar charts show the most frequent categories; the rest are summed into one '(other)' bar
+MAX_CATEGORIES = 30
+OTHER_CATEGORY = "(other)"
+
+def _size(chart_type: str) -> Dict[str, int]:
+    width, height = rendering.CHART_SIZES[chart_type]
+    return {"width": width * PIXELS_PER_INCH, "height": height * PIXELS_PER_INCH}
+
+def _number(value: Any, digits: int) -> Optional[float]:
+    """Rounded JSON-safe float: NaN and infinities become None."""
+    value = float(value)
+    return round(value, digits) if math.isfinite(value) else None
+
+def _column(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df.columns:
+        raise ValueError(f"Column '{column}' not found in DataFrame.")
+    return df[column]
+
+def histogram_bins(series: pd.Series, weights: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """
+    Bins the finite values of a numeric series: [{'bin_start', 'bin_end', 'count'}, ...].
+    With per-row weights (a sample), counts are estimated population counts.
+    """
+    if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        raise ValueError(f"Column '{series.name}' is not numeric; use a bar chart instead.")
+    values = series.to_numpy(dtype="float64", na_value=np.nan)
+    finite = np.isfinite(values)
+    values = values[finite]
+    if weights is not None:
+        weights = weights[finite]
+    if values.size == 0:
+        return []
+    edges = np.histogram_bin_edges(values, bins="auto")
+    if len(edges) - 1 > MAX_BINS:
+        edges = np.histogram_bin_edges(values, bins=MAX_BINS)
+    counts, edges = np.histogram(values, bins=edges, weights=weights)
+    return [
+        {"bin_start": float(start), "bin_end": float(end), "count": int(round(count))}
+        for start, end, count in zip(edges[:-1], edges[1:], counts)
+    ]
+
+def category_counts(series: pd.Series, weights: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """
+    Counts the non-null values of a series, most frequent first: [{'category', 'count'}, ...].
+    With per-row weights (a sample), counts are estimated population counts.
+    """
+    counts = series.value_counts(dropna=True) if weights is None else sampling.weighted_value_counts(series, weights)
+    rows = [{"category": str(category), "count": int(round(count))} for category, count in counts.iloc[:MAX_CATEGORIES].items()]
+    if len(counts) > MAX_CATEGORIES:
+        rows.append({"category": OTHER_CATEGORY, "count": int(round(counts.iloc[MAX_CATEGORIES:].sum()))})
+    return rows
+
+def correlation_matrix(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Pearson correlations of the numeric columns in long form: [{'x', 'y', 'value'}, ...]."""
+    numeric_df = df.select_dtypes(include=['number'])
+    if numeric_df.shape[1] < 2:
+        raise ValueError("Not enough numeric columns for a correlation heatmap.")
+    corr = numeric_df.corr()
+    return [
+        {"x": str(x), "y": str(y), "value": _number(corr.iat[i, j], 4)}
+        for i, y in enumerate(corr.index)
+        for j, x in enumerate(corr.columns)
+    ]
+
+def histogram_spec(df: pd.DataFrame, column: str, weights: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    return {
+        "$schema": VEGA_LITE_SCHEMA,
+        "title": f"Distribution of {column}",
+        **_size("histogram"),
+        "data": {"values": histogram_bins(_column(df, column), weights)},
+        "mark": "bar",
+        "encoding": {
+            "x": {"field": "bin_start", "bin": {"binned": True}, "type": "quantitative", "title": str(column)},
+            "x2": {"field": "bin_end"},
+            "y": {"field": "count", "type": "quantitative", "title": "Frequency"},
+            "tooltip": [
+                {"field": "bin_start", "type": "quantitative", "title": "From"},
+                {"field": "bin_end", "type": "quantitative", "title": "To"},
+                {"field": "count", "type": "quantitative", "title": "Count"},
+            ],
+        },
+    }
+
+def bar_chart_spec(df: pd.DataFrame, column: str, weights: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    return {
+        "$schema": VEGA_LITE_SCHEMA,
+        "title": f"Count of {column}",
+        **_size("bar_chart"),
+        "data": {"values": category_counts(_column(df, column), weights)},
+        "mark": "bar",
+        "encoding": {
+            "y": {"field": "category", "type": "nominal", "sort": None, "title": str(column)},
+            "x": {"field": "count", "type": "quantitative", "title": "Count"},
+            "tooltip": [{"field": "category", "type": "nominal"}, {"field": "count", "type": "quantitative"}],
+        },
+    }
+
+def heatmap_spec(df: pd.DataFrame) -> Dict[str, Any]:
+    encoding = {
+        "x": {"field": "x", "type": "nominal", "sort": None, "title": None},
+        "y": {"field": "y", "type": "nominal", "sort": None, "title": None},
+    }
+    return {
+        "$schema": VEGA_LITE_SCHEMA,
+        "title": "Correlation Heatmap",
+        **_size("heatmap"),
+        "data": {"values": correlation_matrix(df)},
+        "encoding": encoding,
+        "layer": [
+            {
+                "mark": "rect",
+                "encoding": {
+                    "color": {
+                        "field": "value",
+                        "type": "quantitative",
+                        # Blue for negative, red for positive, like the PNG's coolwarm map
+                        "scale": {"scheme": "redblue", "reverse": True, "domain": [-1, 1]},
+                        "title": "r",
+                    },
+                    "tooltip": [
+                        {"field": "x", "type": "nominal"},
+                        {"field": "y", "type": "nominal"},
+                        {"field": "value", "type": "quantitative", "format": ".3f"},
+                    ],
+                },
+            },
+            {"mark": "text", "encoding": {"text": {"field": "value", "type": "quantitative", "format": ".2f"}}},
+        ],
+    }
+
+def chart_spec(df: pd.DataFrame, chart_type: str, column: Optional[str] = None,
+               weights: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """Returns the Vega-Lite spec of one chart; the counterpart of tools.draw_chart."""
+    if chart_type == "heatmap":
+        return heatmap_spec(df)
+    if chart_type == "histogram":
+        return histogram_spec(df, column, weights)
+    if chart_type == "bar_chart":
+        return bar_chart_spec(df, column, weights)
+    raise ValueError(f"Chart type '{chart_type}' not supported.")
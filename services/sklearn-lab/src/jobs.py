@@ -0,0 +1,275 @@
+"""
+Asynchronous training jobs.
+
+A submitted job waits in a queue until one of TRAINING_WORKERS slots is free,
+then trains in its own worker process. Each job gets a process rather than a
+pool slot so it can be cancelled mid-fit by terminating it. The process sends
+progress and its result back over a pipe. Jobs never use the shared process
+pool, so a burst of training cannot starve chart rendering; in monolith mode
+the bound keeps training off most of the node's cores.
+
+Finished jobs are kept for JOB_RETENTION_SECONDS so their status and result
+can still be read.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from common import datasets, executor, log, metrics
+from . import pipelines
+
+# Jobs training at once, each in its own process
+TRAINING_WORKERS = int(os.getenv("TRAINING_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+# Jobs that may wait for a worker; further submissions are rejected
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "64"))
+# How long finished jobs (and their results) are kept
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# Event streams send a heartbeat this often while a job is quiet, so idle connections are not timed out
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+logger = log.get_logger("sklearn-lab.jobs")
+
+JOBS_FINISHED = metrics.counter(
+    "canvaslytics_training_jobs_total", "Training jobs that reached a final state, by state.", ("state",)
+)
+JOB_QUEUE_SECONDS = metrics.histogram(
+    "canvaslytics_training_job_queue_seconds", "Time training jobs waited for a worker."
+)
+
+class JobNotFoundError(KeyError):
+    """Raised for unknown or expired job ids."""
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        super().__init__(job_id)
+
+    def __str__(self):
+        return f"Job '{self.job_id}' not found; finished jobs are kept for {JOB_RETENTION_SECONDS:.0f}s."
+
+class JobQueueFullError(Exception):
+    """Raised when MAX_QUEUED_JOBS jobs are already waiting."""
+
+class Job:
+    """State of one training job. Mutated only on the event loop."""
+    def __init__(self, params: Dict[str, Any], dataset_id: str):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        # Its shared file stays pinned until the job finishes
+        self.dataset_id = dataset_id
+        self.state = QUEUED
+        self.stage: Optional[str] = None
+        self.progress = 0.0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.process: Optional[multiprocessing.Process] = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "model_name": self.params["model_name"],
+            "task_type": self.params["task_type"],
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+    async def update(self, event: str, **changes: Any):
+        """Applies changes, records an event and wakes up event streams."""
+        for name, value in changes.items():
+            setattr(self, name, value)
+        self.events.append({"event": event, "ts": time.time(), **self.to_dict()})
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait_for_event(self, seen: int, timeout: float) -> bool:
+        """Waits until there are more than `seen` events; False on timeout."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: len(self.events) > seen), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+def _job_main(conn, dataset: Tuple[str, str], params: Dict[str, Any]):
+    """Entry point of a job process: trains on the shared dataset file and reports over the pipe."""
+    try:
+        df = datasets.read_dataset_file(dataset[1])
+        result = pipelines.train_model_pipeline(
+            df, progress=lambda stage, fraction: conn.send(("progress", stage, fraction)), **params
+        )
+        conn.send(("result", result))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}" if not isinstance(e, ValueError) else str(e)))
+    finally:
+        conn.close()
+
+def _receive(conn):
+    """Blocks for the next message from a job process; None once it has exited."""
+    try:
+        return conn.recv()
+    except (EOFError, OSError):
+        return None
+
+class JobManager:
+    """Queues, runs, cancels and expires training jobs."""
+    def __init__(self, workers: int = TRAINING_WORKERS, max_queued: int = MAX_QUEUED_JOBS):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._jobs: Dict[str, Job] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        # One thread per running job waits on its pipe
+        self._readers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="training-job")
+        self._context = multiprocessing.get_context(executor.PROCESS_START_METHOD)
+
+    def submit(self, dataset: Tuple[str, str], params: Dict[str, Any]) -> Job:
+        """
+        Queues a job training on a pinned shared dataset reference (see datasets.share).
+        The job takes over the pin and releases it when it finishes; a rejected
+        submission releases it at once.
+
+        Raises:
+            JobQueueFullError: If MAX_QUEUED_JOBS jobs are already waiting.
+        """
+        self._expire()
+        if sum(job.state == QUEUED for job in self._jobs.values()) >= self.max_queued:
+            datasets.store.unpin(dataset[0])
+            raise JobQueueFullError(f"{self.max_queued} training jobs are already queued; retry later.")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        job = Job(params, dataset[0])
+        self._jobs[job.id] = job
+        job.events.append({"event": QUEUED, "ts": job.created_at, **job.to_dict()})
+        job.task = asyncio.create_task(self._run(job, dataset))
+        logger.info("Training job queued", extra={"job_id": job.id, "model_name": params["model_name"]})
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(job_id)
+        return job
+
+    async def cancel(self, job_id: str) -> Job:
+        """Cancels a queued or running job; finished jobs are returned unchanged."""
+        job = self.get(job_id)
+        if job.finished:
+            return job
+        if job.process is not None and job.process.is_alive():
+            # Its pipe closes, and _train stops reading without overwriting the cancelled state
+            job.process.terminate()
+        if job.process is None and job.task is not None:
+            job.task.cancel()
+        await self._finish(job, CANCELLED)
+        return job
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yields the job's events so far, then new ones until it finishes, with heartbeats while idle."""
+        job = self.get(job_id)
+        seen = 0
+        while True:
+            while seen < len(job.events):
+                event = job.events[seen]
+                seen += 1
+                yield event
+                if event["state"] in FINISHED_STATES:
+                    return
+            if not await job.wait_for_event(seen, JOB_HEARTBEAT_SECONDS):
+                yield {"event": "heartbeat", "ts": time.time(), "job_id": job.id}
+
+    async def _run(self, job: Job, dataset: Tuple[str, str]):
+        try:
+            async with self._slots:
+                if job.finished:
+                    return
+                JOB_QUEUE_SECONDS.observe(time.time() - job.created_at)
+                await self._train(job, dataset)
+        except asyncio.CancelledError:
+            await self._finish(job, CANCELLED)
+        except Exception as e:
+            logger.exception("Training job crashed", extra={"job_id": job.id})
+            await self._finish(job, FAILED, error=str(e))
+
+    async def _train(self, job: Job, dataset: Tuple[str, str]):
+        loop = asyncio.get_running_loop()
+        receiver, sender = self._context.Pipe(duplex=False)
+        job.process = self._context.Process(
+            target=_job_main, args=(sender, dataset, job.params), name=f"training-job-{job.id[:8]}", daemon=True
+        )
+        job.process.start()
+        sender.close()
+        await job.update(RUNNING, state=RUNNING, started_at=time.time(), stage="loading")
+        outcome, error = FAILED, "Training process exited without a result."
+        try:
+            while True:
+                message = await loop.run_in_executor(self._readers, _receive, receiver)
+                if message is None:
+                    break
+                if message[0] == "progress" and not job.finished:
+                    await job.update("progress", stage=message[1], progress=message[2])
+                elif message[0] == "result":
+                    job.result = message[1]
+                    outcome, error = SUCCEEDED, None
+                elif message[0] == "error":
+                    error = message[1]
+        finally:
+            receiver.close()
+            await loop.run_in_executor(self._readers, job.process.join)
+        if job.finished:
+            return  # Cancelled while running
+        if outcome == SUCCEEDED:
+            fit_seconds = job.result["fit_seconds"]
+            pipelines.MODEL_FIT_SECONDS.labels(job.params["model_name"], job.params["task_type"]).observe(fit_seconds)
+            logger.info("Training job succeeded", extra={"job_id": job.id, "fit_seconds": fit_seconds})
+        else:
+            logger.warning("Training job failed", extra={"job_id": job.id, "error": error})
+        await self._finish(job, outcome, error=error)
+
+    async def _finish(self, job: Job, state: str, error: Optional[str] = None):
+        if job.finished_at is not None:
+            return
+        # A cancelled job's process is already terminated, so nothing reads the shared file any more
+        datasets.store.unpin(job.dataset_id)
+        JOBS_FINISHED.labels(state).inc()
+        progress = 1.0 if state == SUCCEEDED else job.progress
+        await job.update(state, state=state, finished_at=time.time(), error=error, progress=progress)
+
+    def _expire(self):
+        """Forgets finished jobs older than JOB_RETENTION_SECONDS."""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        states = {state: 0 for state in (QUEUED, RUNNING, *FINISHED_STATES)}
+        for job in self._jobs.values():
+            states[job.state] += 1
+        return {"workers": self.workers, "max_queued": self.max_queued, "jobs": states}
+
+    def shutdown(self):
+        """Terminates running jobs. Called at app shutdown."""
+        for job in self._jobs.values():
+            if job.process is not None and job.process.is_alive():
+                job.process.terminate()
+        self._readers.shutdown(wait=False, cancel_futures=True)
+
+# Process-wide job manager
+manager = JobManager()
@@ -1,13 +1,24 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import orjson
+from contextlib import aclosing, asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
-import pandas as pd
-from . import pipelines
+from typing import Any, AsyncIterator, Dict, List, Optional
+from common import arrow_ipc, datasets, executor, fast_json, log, metrics, tracing
+from . import jobs, pipelines
 
 # --- Pydantic Models for Request/Response Validation ---
+# Bodies are read with fast_json.fast_body: Pydantic validates the envelope fields,
+# while 'data' records are checked as they are turned into a DataFrame.
 
-class TrainRequestPayload(BaseModel):
+class DatasetPayload(BaseModel):
     data: List[Dict[str, Any]]
+
+class TrainRequestPayload(BaseModel):
+    # Either inline records or the id returned by /datasets
+    data: Optional[List[Dict[str, Any]]] = None
+    dataset_id: Optional[str] = None
     features: List[str]
     target: str
     model_name: str
@@ -15,41 +26,202 @@ class TrainRequestPayload(BaseModel):
 
 # --- FastAPI Application ---
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts the event-loop lag monitor on startup; stops it, running training jobs and the worker pools on shutdown."""
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    yield
+    lag_monitor.cancel()
+    jobs.manager.shutdown()
+    executor.shutdown()
+
 app = FastAPI(
     title="CanvasLytics ML Lab Service",
     description="A microservice for training Scikit-learn models.",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=fast_json.ORJSONResponse,
 )
+# Log records carry the X-Request-ID sent by the agent; spans continue the agent's traceparent
+app.add_middleware(log.RequestIdMiddleware)
+app.add_middleware(tracing.TraceMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+tracing.set_service("sklearn-lab")
+datasets.use_spill_dir("sklearn-lab")
 
 @app.get("/", tags=["Health Check"])
 async def read_root():
     """Root endpoint for health checks."""
     return {"status": "ok", "message": "Scikit-learn Lab service is running"}
 
-@app.post("/train", tags=["Machine Learning"])
-async def train_model(payload: TrainRequestPayload):
+@app.get("/stats", tags=["Diagnostics"])
+async def read_stats():
+    """Returns dataset store counters, worker pool queue metrics and training job counts."""
+    return {"status": "ok", "datasets": datasets.store.stats(), "executor": executor.stats(), "jobs": jobs.manager.stats()}
+
+@app.get("/metrics", tags=["Diagnostics"])
+async def read_metrics():
+    """Prometheus metrics: route latencies, payload sizes, rows processed, model fit times and event-loop lag."""
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/debug/traces", tags=["Diagnostics"])
+async def read_traces(trace_id: Optional[str] = None, limit: int = 20):
+    """Returns recent traces recorded by this service, or only the spans of `trace_id`."""
+    return {"status": "ok", "traces": tracing.traces(trace_id, limit)}
+
+@app.post("/datasets", tags=["Datasets"], openapi_extra=fast_json.openapi_body(DatasetPayload))
+async def register_dataset(payload: DatasetPayload = Depends(fast_json.fast_body(DatasetPayload))):
+    """
+    Registers a dataset once so later training requests can refer to it by dataset_id.
+    """
+    try:
+        df = await executor.run_in_thread(datasets.records_to_dataframe, payload.data)
+        metrics.record_dataframe("register", df)
+        return await executor.run_in_thread(datasets.register, df)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/datasets/arrow", tags=["Datasets"])
+async def register_arrow_dataset(request: Request):
+    """
+    Registers a dataset sent as an Arrow IPC stream (`application/vnd.apache.arrow.stream`).
+    Columnar and binary, it is much smaller and faster to decode than JSON records.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type != arrow_ipc.ARROW_STREAM_MEDIA_TYPE:
+        raise HTTPException(status_code=415, detail=f"Expected Content-Type '{arrow_ipc.ARROW_STREAM_MEDIA_TYPE}'.")
+    try:
+        df = await executor.run_in_thread(arrow_ipc.dataframe_from_arrow_stream, await request.body())
+        metrics.record_dataframe("register", df)
+        return await executor.run_in_thread(datasets.register, df)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/train", tags=["Machine Learning"], openapi_extra=fast_json.openapi_body(TrainRequestPayload))
+async def train_model(payload: TrainRequestPayload = Depends(fast_json.fast_body(TrainRequestPayload))):
     """
     Receives data and training parameters, builds a pipeline,
     trains a model, and returns the evaluation metrics and model artifact.
     """
     try:
-        # Convert incoming data to a DataFrame
-        df = pd.DataFrame(payload.data)
+        # Convert incoming data to a DataFrame, or look up the registered dataset
+        df = await executor.run_in_thread(datasets.resolve_dataframe, payload.data, payload.dataset_id)
+        metrics.record_dataframe("train", df)
         
-        # Call the training pipeline
-        result = pipelines.train_model_pipeline(
+        # Fit in a worker process so a long training run does not block the event loop
+        result = await executor.run_in_process(
+            pipelines.train_model_pipeline,
             df=df,
             features=payload.features,
             target=payload.target,
             model_name=payload.model_name,
             task_type=payload.task_type
         )
+        pipelines.MODEL_FIT_SECONDS.labels(payload.model_name, payload.task_type).observe(result["fit_seconds"])
         
         return {"status": "success", "result": result}
         
+    except datasets.DatasetNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except ValueError as e:
         # Handle known errors like missing columns or unsupported models
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         # Handle unexpected errors during training
-        raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+
+# --- Training jobs ---
+# Long fits run as background jobs: submit returns at once with a job id, and the
+# job's state, progress events and result are read from the endpoints below.
+
+@app.post("/jobs/train", status_code=202, tags=["Training Jobs"], openapi_extra=fast_json.openapi_body(TrainRequestPayload))
+async def submit_training_job(payload: TrainRequestPayload = Depends(fast_json.fast_body(TrainRequestPayload))):
+    """
+    Validates a training request and queues it as a job. Returns 202 with the
+    job, or 429 when too many jobs are already waiting.
+    """
+    try:
+        df = await executor.run_in_thread(datasets.resolve_dataframe, payload.data, payload.dataset_id)
+        pipelines.validate_request(df, payload.features, payload.target, payload.model_name, payload.task_type)
+        metrics.record_dataframe("train_job", df)
+        # The job process loads the dataset from its shared file instead of receiving a pickled copy;
+        # the file is pinned until the job finishes, as the job may wait in the queue for a while
+        dataset = await executor.run_in_thread(datasets.share, df, payload.dataset_id, True)
+    except datasets.DatasetNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    params = {
+        "features": payload.features,
+        "target": payload.target,
+        "model_name": payload.model_name,
+        "task_type": payload.task_type,
+    }
+    try:
+        job = jobs.manager.submit(dataset, params)
+    except jobs.JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"status": "success", "job": job.to_dict()}
+
+def _get_job(job_id: str) -> jobs.Job:
+    try:
+        return jobs.manager.get(job_id)
+    except jobs.JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.get("/jobs/{job_id}", tags=["Training Jobs"])
+async def read_job(job_id: str):
+    """Returns a job's state, current stage and progress (0 to 1)."""
+    return {"status": "success", "job": _get_job(job_id).to_dict()}
+
+@app.post("/jobs/{job_id}/cancel", tags=["Training Jobs"])
+async def cancel_job(job_id: str):
+    """Cancels a queued or running job, stopping its process; a finished job is returned unchanged."""
+    _get_job(job_id)
+    job = await jobs.manager.cancel(job_id)
+    return {"status": "success", "job": job.to_dict()}
+
+@app.get("/jobs/{job_id}/result", tags=["Training Jobs"])
+async def read_job_result(job_id: str):
+    """Returns the metrics and model artifact of a succeeded job; 409 while it is not finished or if it failed."""
+    job = _get_job(job_id)
+    if job.state != jobs.SUCCEEDED:
+        detail = f"Job is {job.state}" + (f": {job.error}" if job.error else ".")
+        raise HTTPException(status_code=409, detail=detail)
+    return {"status": "success", "job": job.to_dict(), "result": job.result}
+
+@app.get("/jobs/{job_id}/events", tags=["Training Jobs"])
+async def stream_job_events(job_id: str):
+    """
+    Streams a job's events as NDJSON: its history so far, then each state or
+    progress change until it finishes, with 'heartbeat' lines while it is quiet.
+    """
+    events = await job_events(job_id)
+
+    async def lines():
+        async with aclosing(events):
+            async for event in events:
+                yield orjson.dumps(event) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def job_events(job_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """Returns the iterator of a job's events; an unknown job is raised as HTTPException."""
+    _get_job(job_id)
+    return jobs.manager.events(job_id)
+
+# Routes the agent calls directly in monolith mode (TOOL_DISPATCH=inprocess): path -> (body model, handler).
+# Handlers take the validated body (or only the path parameters when the model is None)
+# and raise HTTPException exactly as over HTTP.
+IN_PROCESS_ROUTES = {
+    "/datasets": (DatasetPayload, register_dataset),
+    "/train": (TrainRequestPayload, train_model),
+    "/jobs/train": (TrainRequestPayload, submit_training_job),
+    "/jobs/{job_id}": (None, read_job),
+    "/jobs/{job_id}/cancel": (None, cancel_job),
+    "/jobs/{job_id}/result": (None, read_job_result),
+}
+# Streaming routes: path -> (body model, function returning the iterator of events)
+IN_PROCESS_STREAMS = {
+    "/jobs/{job_id}/events": (None, job_events),
+}
@@ -2,6 +2,7 @@ import pandas as pd
 import joblib
 import io
 import base64
+import time
 
 from sklearn.model_selection import train_test_split
 from sklearn.compose import ColumnTransformer
@@ -20,7 +21,13 @@ from sklearn.ensemble import RandomForestRegressor
 # Metrics
 from sklearn.metrics import accuracy_score, confusion_matrix, r2_score, mean_squared_error
 
-from typing import Dict, Any, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from common import metrics, tracing
+
+# Observed by the serving process from the returned fit_seconds
+MODEL_FIT_SECONDS = metrics.histogram(
+    "canvaslytics_model_fit_seconds", "Time spent in pipeline.fit, by model and task type.", ("model_name", "task_type")
+)
 
 def create_preprocessor(numeric_features: List[str], categorical_features: List[str]) -> ColumnTransformer:
     """Creates a preprocessing pipeline for numeric and categorical features."""
@@ -61,16 +68,30 @@ def get_model(model_name: str, task_type: str):
     
     return models[task_type][model_name]
 
+def validate_request(df: pd.DataFrame, features: List[str], target: str, model_name: str, task_type: str):
+    """Raises ValueError for requests train_model_pipeline would reject, before any work is queued."""
+    get_model(model_name, task_type)
+    if target not in df.columns:
+        raise ValueError(f"Target column '{target}' not in DataFrame.")
+    if not all(f in df.columns for f in features):
+        raise ValueError("One or more feature columns not found in DataFrame.")
+
 def train_model_pipeline(
     df: pd.DataFrame, 
     features: List[str], 
     target: str, 
     model_name: str,
-    task_type: str = "classification"
+    task_type: str = "classification",
+    progress: Optional[Callable[[str, float], None]] = None
 ) -> Dict[str, Any]:
     """
     Trains a full ML pipeline and returns metrics and the serialized model.
+
+    `progress`, if given, is called with the stage name and the approximate
+    fraction of the work done as each stage starts.
     """
+    report = progress or (lambda stage, fraction: None)
+    report("preprocessing", 0.05)
     if target not in df.columns:
         raise ValueError(f"Target column '{target}' not in DataFrame.")
     if not all(f in df.columns for f in features):
@@ -92,27 +113,36 @@ def train_model_pipeline(
 
     # Split data and train
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    pipeline.fit(X_train, y_train)
+    report("fitting", 0.1)
+    fit_started_at = time.perf_counter()
+    with tracing.span("fit", rows=len(X_train), model=model_name):
+        pipeline.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - fit_started_at
 
     # Evaluate model
-    y_pred = pipeline.predict(X_test)
+    report("evaluating", 0.8)
+    with tracing.span("evaluate"):
+        y_pred = pipeline.predict(X_test)
 
-    metrics = {}
+    scores = {}
     if task_type == "classification":
-        metrics['accuracy'] = accuracy_score(y_test, y_pred)
-        metrics['confusion_matrix'] = confusion_matrix(y_test, y_pred).tolist()
+        scores['accuracy'] = accuracy_score(y_test, y_pred)
+        scores['confusion_matrix'] = confusion_matrix(y_test, y_pred).tolist()
     elif task_type == "regression":
-        metrics['r2_score'] = r2_score(y_test, y_pred)
-        metrics['mean_squared_error'] = mean_squared_error(y_test, y_pred)
+        scores['r2_score'] = r2_score(y_test, y_pred)
+        scores['mean_squared_error'] = mean_squared_error(y_test, y_pred)
 
     # Serialize the trained pipeline using joblib and encode with base64
-    buffer = io.BytesIO()
-    joblib.dump(pipeline, buffer)
-    buffer.seek(0)
-    model_artifact = base64.b64encode(buffer.read()).decode('utf-8')
+    report("serializing", 0.9)
+    with tracing.span("encode"):
+        buffer = io.BytesIO()
+        joblib.dump(pipeline, buffer)
+        buffer.seek(0)
+        model_artifact = base64.b64encode(buffer.read()).decode('utf-8')
 
     return {
-        "metrics": metrics,
+        "metrics": scores,
         "model_name": model_name,
-        "model_artifact_b64": model_artifact
+        "model_artifact_b64": model_artifact,
+        "fit_seconds": fit_seconds
     }
\ No newline at end of file